@@ -0,0 +1,109 @@
+# admin_digest.py
+"""Сводные уведомления администратору.
+
+События (удаление из группы, новые платежи) записываются в таблицу
+admin_events — в той же транзакции, что и само изменение, — и раз в окно
+ADMIN_DIGEST_WINDOW секунд уходят одним сообщением, а при большом количестве —
+коротким итогом с CSV-файлом во вложении. Сводку отправляет ведущий процесс;
+события удаляются только после успешной отправки, так что ни перезапуск,
+ни смена ведущего, ни ошибка Telegram их не теряют (сводка может прийти
+повторно, как и сообщения outbox).
+"""
+import asyncio
+import csv
+import io
+import logging
+from collections import Counter
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile
+
+import config
+import db
+from ratelimit import call_with_retry
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram с запасом
+MAX_MESSAGE_LEN = 3500
+# Больше событий за одну сводку не берём; остальные уйдут следующей
+MAX_DIGEST_EVENTS = 5000
+
+EVENT_TITLES = {
+    "expired": "👋 Удалены из группы по истечении подписки",
+    "payment": "💰 Новые платежи",
+}
+
+
+class AdminDigest:
+    """Отправляет ADMIN_ID накопленные в admin_events события пачкой раз в окно."""
+
+    def __init__(self, window: float, csv_threshold: int):
+        self.window = window
+        self.csv_threshold = csv_threshold
+
+    async def add(self, kind: str, text: str, tg_id: int | None = None, username: str | None = None):
+        """Записывает событие; внутри `async with db.transaction()` — вместе с остальными изменениями."""
+        if not config.ADMIN_ID:
+            return
+        await db.add_admin_event(kind, text, tg_id, username)
+
+    async def flush(self, bot: Bot):
+        events = await db.get_admin_events(MAX_DIGEST_EVENTS)
+        if not events:
+            return
+
+        try:
+            await self._send(bot, events)
+        except Exception as e:
+            # События остаются в таблице и уйдут следующей сводкой
+            logger.error(f"Не удалось отправить сводку админу ({len(events)} событий), повторю позже: {e}")
+            return
+        await db.delete_admin_events([e["id"] for e in events])
+
+    async def _send(self, bot: Bot, events: list[dict]):
+        if len(events) == 1:
+            await call_with_retry(config.ADMIN_ID, bot.send_message, config.ADMIN_ID, events[0]["text"])
+            return
+
+        summary = self._summary(events)
+        lines = [summary] + [f"• {e['text']}" for e in events]
+        text = "\n\n".join(lines)
+        if len(events) <= self.csv_threshold and len(text) <= MAX_MESSAGE_LEN:
+            await call_with_retry(config.ADMIN_ID, bot.send_message, config.ADMIN_ID, text)
+        else:
+            await call_with_retry(
+                config.ADMIN_ID, bot.send_document,
+                config.ADMIN_ID,
+                BufferedInputFile(self._to_csv(events), filename=f"digest_{datetime.now():%Y%m%d_%H%M%S}.csv"),
+                caption=summary,
+            )
+
+    @staticmethod
+    def _summary(events: list[dict]) -> str:
+        counts = Counter(e["kind"] for e in events)
+        rows = [f"{EVENT_TITLES.get(kind, kind)}: {n}" for kind, n in counts.items()]
+        return "📋 Сводка событий\n" + "\n".join(rows)
+
+    @staticmethod
+    def _to_csv(events: list[dict]) -> bytes:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["time", "kind", "tg_id", "username", "text"])
+        for e in events:
+            created_at = datetime.fromtimestamp(e["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            writer.writerow([created_at, e["kind"], e["tg_id"], e["username"], e["text"]])
+        return buf.getvalue().encode("utf-8-sig")
+
+    async def run(self, bot: Bot):
+        """Раз в окно отправляет накопленное; запускать через Lease("admin_digest").run_as_leader."""
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush(bot)
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки админу: {e}")
+
+
+admin_digest = AdminDigest(config.ADMIN_DIGEST_WINDOW, config.ADMIN_DIGEST_CSV_THRESHOLD)
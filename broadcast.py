@@ -0,0 +1,109 @@
+# broadcast.py
+"""Рассылка сообщения всем активным подписчикам.
+
+Админ отвечает командой /broadcast на сообщение — оно копируется каждому
+пользователю с действующей подпиской. Получатели читаются из users страницами
+по BROADCAST_PAGE_SIZE (keyset по tg_id), поэтому в памяти держится только
+текущая страница. После каждой страницы в таблицу broadcasts записываются
+контрольная точка и счётчики; после перезапуска рассылка продолжается с неё,
+повторно может уйти не больше одной страницы.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from contextlib import suppress
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+import db
+import outbox
+from ratelimit import call_with_retry, run_pool
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_PAGE_SIZE = 500
+BROADCAST_CONCURRENCY = 20
+# Как часто проверять новые рассылки, созданные в других процессах
+POLL_INTERVAL = 30
+
+_wake = asyncio.Event()
+
+
+async def start_broadcast(admin_id: int, from_chat_id: int, message_id: int) -> int:
+    """Создаёт рассылку; отправку выполняет run() в ведущем процессе."""
+    broadcast_id = await db.create_broadcast(admin_id, from_chat_id, message_id)
+    db.after_commit(_wake.set)
+    return broadcast_id
+
+
+def format_report(broadcast: dict) -> str:
+    status = {
+        "running": "⏳ выполняется",
+        "done": "✅ завершена",
+        "cancelled": "⛔️ остановлена",
+    }.get(broadcast["status"], broadcast["status"])
+    return (
+        f"📣 Рассылка #{broadcast['id']}: {status}\n\n"
+        f"📬 Доставлено: {broadcast['delivered']}\n"
+        f"🚫 Заблокировали бота: {broadcast['blocked']}\n"
+        f"❌ Ошибки: {broadcast['failed']}"
+    )
+
+
+async def _send_page(bot: Bot, broadcast: dict, recipients: list[int]) -> Counter:
+    stats = Counter()
+
+    async def _send(tg_id: int):
+        try:
+            await call_with_retry(tg_id, bot.copy_message, tg_id, broadcast["from_chat_id"], broadcast["message_id"])
+            stats["delivered"] += 1
+        except TelegramForbiddenError:
+            stats["blocked"] += 1
+        except Exception as e:
+            logger.warning("Рассылка #%s: не удалось отправить %s: %s", broadcast["id"], tg_id, e)
+            stats["failed"] += 1
+
+    await run_pool(recipients, _send, concurrency=BROADCAST_CONCURRENCY)
+    return stats
+
+
+async def run_broadcast(bot: Bot, broadcast: dict):
+    """Отправляет рассылку, начиная с её контрольной точки."""
+    broadcast_id = broadcast["id"]
+    last_tg_id = broadcast["last_tg_id"] or 0
+    logger.info("Рассылка #%s: старт с tg_id > %s", broadcast_id, last_tg_id)
+
+    while True:
+        # Активность подписки проверяем на момент выборки страницы
+        recipients = await db.get_broadcast_recipients(last_tg_id, int(time.time()), BROADCAST_PAGE_SIZE)
+        if not recipients:
+            break
+        stats = await _send_page(bot, broadcast, recipients)
+        last_tg_id = recipients[-1]
+        await db.save_broadcast_progress(
+            broadcast_id, last_tg_id, stats["delivered"], stats["blocked"], stats["failed"]
+        )
+        current = await db.get_broadcast(broadcast_id)
+        if current["status"] != "running":
+            logger.info("Рассылка #%s остановлена админом", broadcast_id)
+            return
+
+    if await db.finish_broadcast(broadcast_id, "done"):
+        result = await db.get_broadcast(broadcast_id)
+        logger.info("Рассылка #%s завершена: %s", broadcast_id, result)
+        await outbox.send_message(result["admin_id"], format_report(result))
+
+
+async def run(bot: Bot):
+    """Выполняет незавершённые рассылки по очереди и ждёт новых."""
+    while True:
+        _wake.clear()
+        try:
+            for broadcast in await db.get_running_broadcasts():
+                await run_broadcast(bot, broadcast)
+        except Exception as e:
+            logger.error(f"Ошибка рассылки: {e}")
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_wake.wait(), timeout=POLL_INTERVAL)
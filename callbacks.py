@@ -0,0 +1,157 @@
+# callbacks.py
+"""Схема callback_data кнопок и диспетчеризация нажатий.
+
+Каждая кнопка описывается фабрикой CallbackData с коротким префиксом
+(«pay:s:50000», «review:42:1»). Единственный хендлер callback_query в
+`router` отделяет префикс, находит обработчик в словаре и вызывает его с уже
+разобранными данными — без перебора фильтров по всем роутерам. Обработчики
+регистрируются декоратором `on(Фабрика)`.
+
+Кнопки в уже отправленных сообщениях содержат старый формат
+(«create_pending:subscription:50000», «approve:42»); такие данные переводятся
+в новые фабрики по таблице _LEGACY.
+"""
+from enum import Enum
+from typing import Any, Callable
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+
+class Service(str, Enum):
+    """Услуга; в pending_payments.plan хранится имя (Service.subscription.name)."""
+    subscription = "s"
+    consultation = "c"
+    amulet = "a"
+
+
+class MainMenu(CallbackData, prefix="menu"):
+    pass
+
+
+class Offer(CallbackData, prefix="offer"):
+    service: Service
+
+
+class AcceptOffer(CallbackData, prefix="accept"):
+    service: Service
+
+
+class CreatePending(CallbackData, prefix="pay"):
+    service: Service
+    amount: int  # в копейках
+
+
+class AttachReceipt(CallbackData, prefix="receipt"):
+    pid: int
+
+
+class Decision(CallbackData, prefix="review"):
+    pid: int
+    approve: bool
+
+
+class PaymentProcessed(CallbackData, prefix="done"):
+    pass
+
+
+class Export(CallbackData, prefix="export"):
+    name: str
+
+
+# Консоль проверки заявок (/review); after — id последней заявки предыдущей страницы
+class ReviewPage(CallbackData, prefix="queue"):
+    after: int
+
+
+class ReviewPick(CallbackData, prefix="pick"):
+    pid: int
+    after: int
+
+
+class ReviewPickPage(CallbackData, prefix="pickall"):
+    after: int
+
+
+class ReviewBulk(CallbackData, prefix="bulk"):
+    approve: bool
+    after: int
+
+
+# Префикс -> (фабрика, обработчик)
+_handlers: dict[str, tuple[type[CallbackData], CallableObject]] = {}
+
+
+def on(factory: type[CallbackData]):
+    """Регистрирует обработчик нажатий на кнопки фабрики `factory`.
+
+    Обработчик получает CallbackQuery, callback_data (экземпляр фабрики) и,
+    если объявит их в сигнатуре, остальные данные aiogram (state, bot и т.д.).
+    """
+    def decorator(fn: Callable) -> Callable:
+        assert factory.__prefix__ not in _handlers, f"обработчик для {factory.__prefix__!r} уже есть"
+        _handlers[factory.__prefix__] = (factory, CallableObject(fn))
+        return fn
+    return decorator
+
+
+def _legacy_pending(rest: str) -> CreatePending:
+    service, amount = rest.split(":", 1)
+    return CreatePending(service=Service[service], amount=int(amount))
+
+
+# Старые callback_data (имя до ":") -> фабрика
+_LEGACY: dict[str, Callable[[str], CallbackData]] = {
+    "back_main": lambda rest: MainMenu(),
+    "buy_subscription": lambda rest: Offer(service=Service.subscription),
+    "buy_consultation": lambda rest: Offer(service=Service.consultation),
+    "buy_amulet": lambda rest: Offer(service=Service.amulet),
+    "back_offer": lambda rest: Offer(service=Service.subscription),
+    "accept_offer": lambda rest: AcceptOffer(service=Service[rest or "subscription"]),
+    "create_pending": _legacy_pending,
+    "attach_receipt": lambda rest: AttachReceipt(pid=int(rest)),
+    "approve": lambda rest: Decision(pid=int(rest), approve=True),
+    "reject": lambda rest: Decision(pid=int(rest), approve=False),
+    "already_processed": lambda rest: PaymentProcessed(),
+    "agreements": lambda rest: Export(name="agreements"),
+}
+
+
+def parse(data: str) -> CallbackData | None:
+    """Разбирает callback_data в экземпляр фабрики; None — неизвестная или испорченная кнопка."""
+    prefix, _, rest = data.partition(":")
+    try:
+        entry = _handlers.get(prefix)
+        if entry is not None:
+            return entry[0].unpack(data)
+        legacy = _LEGACY.get(prefix)
+        return legacy(rest) if legacy is not None else None
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def resolve(data: str) -> tuple[str, Callable] | None:
+    """Префикс фабрики и функция-обработчик для callback_data (метки метрик); None — неизвестная кнопка."""
+    prefix = data.partition(":")[0]
+    if prefix not in _handlers:
+        callback_data = parse(data)
+        if callback_data is None:
+            return None
+        prefix = callback_data.__prefix__
+    return prefix, _handlers[prefix][1].callback
+
+
+router = Router()
+
+
+@router.callback_query()
+async def dispatch(callback: CallbackQuery, **data: Any):
+    callback_data = parse(callback.data or "")
+    if callback_data is None:
+        # Кнопка из удалённой версии бота — просто гасим «часики»
+        await callback.answer()
+        return None
+    handler = _handlers[callback_data.__prefix__][1]
+    return await handler.call(callback, callback_data=callback_data, **data)
@@ -11,7 +11,7 @@ cur.execute("""
     UPDATE users
     SET subscription_end = ?, in_group = ?
     WHERE tg_id = ?
-""", ((datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"), 1, tg_id))
+""", (int((datetime.now() - timedelta(days=1)).timestamp()), 1, tg_id))
 
 conn.commit()
 conn.close()
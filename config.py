@@ -7,13 +7,60 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
 PAYMENT_TOKEN = os.getenv("PAYMENT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///bot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 4))
+
+# Кэш записей users в процессе: размер, время жизни (сек) и способ сброса между процессами:
+# "local" — только TTL, "postgres" — LISTEN/NOTIFY (нужен PostgreSQL)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10_000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "local")
+
+# FSM-состояния: "memory" (LRU в процессе) или "db" (общие для нескольких процессов)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", 24 * 60 * 60))
+FSM_MEMORY_MAX_SIZE = int(os.getenv("FSM_MEMORY_MAX_SIZE", 100_000))
+
+# Режим получения обновлений: "polling" (разработка) или "webhook" (за reverse proxy)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # обязателен в режиме webhook
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 8080))
+# Число процессов-обработчиков (только для webhook; FSM_STORAGE должен быть "db")
+WORKERS = int(os.getenv("WORKERS", 1))
+# Отдельный HTTP-сервер с /metrics на METRICS_PORT + номер воркера (0 — выключен;
+# в webhook-режиме /metrics есть и на основном порту)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Логи: файл с ротацией по размеру, формат файла "json" или "text", прореживание массовых событий
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 20 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+LOG_SAMPLED_LOGGERS = tuple(filter(None, os.getenv("LOG_SAMPLED_LOGGERS", "aiogram.event").split(",")))
+
+# Антифлуд: сколько нажатий/сообщений в секунду разрешено пользователю, размер всплеска
+# и число слотов таблицы корзин (память ~17 байт на слот, не зависит от числа пользователей)
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", 1))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", 5))
+THROTTLE_SLOTS = int(os.getenv("THROTTLE_SLOTS", 1 << 16))
 
 PRIVATE_GROUP_CHAT_ID = int(os.getenv("PRIVATE_GROUP_CHAT_ID", 0))
 
+# Сколько свободных ссылок-приглашений держать в пуле
+INVITE_POOL_SIZE = int(os.getenv("INVITE_POOL_SIZE", 20))
+
 PUBLIC_GROUP_URL = os.getenv("PUBLIC_GROUP_URL")
 
 BLOG_URL = os.getenv("BLOG_URL")
 
 ADMIN_URL = os.getenv("ADMIN_URL")
 
-PAYMENT_REQUISITES = os.getenv('PAYMENT_REQUISITES')
\ No newline at end of file
+PAYMENT_REQUISITES = os.getenv('PAYMENT_REQUISITES')
+
+# Сводки для админа: окно накопления (сек) и порог, после которого список уходит CSV-файлом
+ADMIN_DIGEST_WINDOW = float(os.getenv("ADMIN_DIGEST_WINDOW", 60))
+ADMIN_DIGEST_CSV_THRESHOLD = int(os.getenv("ADMIN_DIGEST_CSV_THRESHOLD", 30))
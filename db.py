@@ -1,346 +1,821 @@
 # db.py
-import sqlite3
+import asyncio
+import contextvars
+import inspect
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional
-
-DB_PATH = "bot.db"
-
-
-def _conn():
-    return sqlite3.connect(DB_PATH)
-
-
-def init_db():
-    conn = _conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        tg_id INTEGER PRIMARY KEY,
-        username TEXT,
-        subscription_end TEXT,
-        in_group INTEGER DEFAULT 0,
-        notify_7_days INTEGER DEFAULT 0,
-        notify_1_day INTEGER DEFAULT 0,
-        last_invoice_time TEXT
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS invite_links (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        tg_id INTEGER,
-        invite_link TEXT UNIQUE,
-        created_at TEXT DEFAULT (datetime('now')),
-        used INTEGER DEFAULT 0
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS agreements (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        tg_id INTEGER,
-        username TEXT,
-        offer_type TEXT,
-        offer_version TEXT,
-        accepted_at TEXT
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS pending_payments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        tg_id INTEGER,
-        username TEXT,
-        plan TEXT,
-        amount INTEGER,
-        status TEXT DEFAULT 'pending', -- pending, awaiting_review, confirmed, rejected, cancelled
-        proof_file_id TEXT,
-        created_at TEXT DEFAULT (datetime('now')),
-        admin_id INTEGER,
-        admin_note TEXT
-    )
-    """)
-
-    conn.commit()
-    conn.close()
-
-
-def add_or_update_user(tg_id: int, days: int = 30, username: str | None = None, in_group: bool = False):
-    """Добавляет или продлевает подписку; возвращает datetime object новой даты окончания."""
-    conn = _conn()
-    cur = conn.cursor()
-
-    cur.execute("SELECT subscription_end FROM users WHERE tg_id = ?", (tg_id,))
-    result = cur.fetchone()
-
-    if result and result[0]:
-        try:
-            current_end = datetime.strptime(result[0], "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            current_end = datetime.now()
-        new_end = current_end + timedelta(days=days)
+from typing import Callable, Optional
+
+import config
+import metrics
+import migrations
+from cache import LRUCache
+from storage import SQLitePool, PostgresPool, create_pool
+
+DATABASE_URL = config.DATABASE_URL
+
+_pool: SQLitePool | PostgresPool | None = None
+_pool_lock = asyncio.Lock()
+# Соединение открытой транзакции: вызовы db.* внутри `async with db.transaction()` используют его
+_tx_conn: contextvars.ContextVar = contextvars.ContextVar("db_tx_conn", default=None)
+# Колбэки, которые нужно вызвать после фиксации открытой транзакции
+_tx_callbacks: contextvars.ContextVar = contextvars.ContextVar("db_tx_callbacks", default=None)
+# Подписчики на изменение даты окончания подписки (tg_id, new_end)
+_subscription_listeners: list[Callable[[int, datetime], None]] = []
+# Кэш записей users: tg_id -> {"subscription_end", "in_group", "username"} или None
+user_cache = LRUCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+USER_CACHE_CHANNEL = "user_cache"
+
+metrics.Gauge("bot_user_cache_size", "Записей в кэше users", lambda: user_cache.stats()["size"])
+metrics.Gauge("bot_user_cache_hits_total", "Попадания в кэш users", lambda: user_cache.hits, kind="counter")
+metrics.Gauge("bot_user_cache_misses_total", "Промахи кэша users", lambda: user_cache.misses, kind="counter")
+metrics.Gauge("bot_user_cache_evictions_total", "Вытеснения из кэша users", lambda: user_cache.evictions,
+              kind="counter")
+
+
+def _now_str() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _to_epoch(dt: datetime) -> int:
+    return int(dt.timestamp())
+
+
+async def _get_pool() -> SQLitePool | PostgresPool:
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                pool = create_pool(DATABASE_URL, size=config.DB_POOL_SIZE)
+                await pool.open()
+                _pool = pool
+    return _pool
+
+
+@asynccontextmanager
+async def _conn():
+    conn = _tx_conn.get()
+    if conn is not None:
+        yield conn
+        return
+    pool = await _get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def transaction():
+    """Выполняет все вложенные вызовы db.* в одной транзакции."""
+    conn = _tx_conn.get()
+    if conn is not None:
+        yield conn
+        return
+    pool = await _get_pool()
+    callbacks: list[Callable[[], None]] = []
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            token = _tx_conn.set(conn)
+            callbacks_token = _tx_callbacks.set(callbacks)
+            try:
+                yield conn
+            finally:
+                _tx_callbacks.reset(callbacks_token)
+                _tx_conn.reset(token)
+    for callback in callbacks:
+        callback()
+
+
+def after_commit(callback: Callable[[], None]):
+    """Вызывает callback после фиксации текущей транзакции, а вне транзакции — сразу."""
+    callbacks = _tx_callbacks.get()
+    if callbacks is None:
+        callback()
     else:
-        new_end = datetime.now() + timedelta(days=days)
+        callbacks.append(callback)
 
-    subscription_end_str = new_end.strftime("%Y-%m-%d %H:%M:%S")
 
-    cur.execute("SELECT tg_id FROM users WHERE tg_id = ?", (tg_id,))
-    existing = cur.fetchone()
-    if existing:
-        cur.execute("""
-            UPDATE users
-            SET subscription_end = ?, username = ?, in_group = ?
-            WHERE tg_id = ?
-        """, (subscription_end_str, username, 1 if in_group else 0, tg_id))
-    else:
-        cur.execute("""
-            INSERT INTO users (tg_id, username, subscription_end, in_group)
-            VALUES (?, ?, ?, ?)
-        """, (tg_id, username, subscription_end_str, 1 if in_group else 0))
+async def close():
+    """Закрывает пул соединений (при остановке бота)."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def init_db() -> list[int]:
+    """Применяет миграции схемы (migrations.py); возвращает номера применённых сейчас."""
+    pool = await _get_pool()
+    async with _conn() as conn:
+        return await migrations.migrate(conn, pool.dialect)
+
 
-    conn.commit()
-    conn.close()
+async def add_or_update_user(tg_id: int, days: int = 30, username: str | None = None):
+    """Добавляет или продлевает подписку; возвращает datetime object новой даты окончания.
+
+    in_group не трогает: членство в группе отслеживается по апдейтам chat_member.
+    """
+    async with transaction() as conn:
+        result = await conn.fetchrow("SELECT subscription_end FROM users WHERE tg_id = ?", tg_id)
+
+        if result and result[0]:
+            current_end = datetime.fromtimestamp(result[0])
+            new_end = current_end + timedelta(days=days)
+        else:
+            new_end = datetime.now() + timedelta(days=days)
+        # Храним с точностью до секунды, как и раньше в строковом формате
+        new_end = new_end.replace(microsecond=0)
+
+        if result:
+            await conn.execute("""
+                UPDATE users
+                SET subscription_end = ?, username = ?,
+                    notify_7_days = 0, notify_1_day = 0
+                WHERE tg_id = ?
+            """, _to_epoch(new_end), username, tg_id)
+        else:
+            await conn.execute("""
+                INSERT INTO users (tg_id, username, subscription_end, in_group)
+                VALUES (?, ?, ?, 0)
+            """, tg_id, username, _to_epoch(new_end))
+        await _invalidate_users(conn, [tg_id])
+
+    notify_subscription_change(tg_id, new_end)
     return new_end
 
 
-def is_user_in_group(tg_id: int) -> bool:
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("SELECT in_group FROM users WHERE tg_id = ?", (tg_id,))
-    r = cur.fetchone()
-    conn.close()
-    return bool(r[0]) if r else False
+async def _invalidate_users(conn, tg_ids: list[int]):
+    """Сбрасывает записи users в кэше сейчас и после фиксации транзакции.
+
+    Повторный сброс после COMMIT нужен, чтобы параллельное чтение не вернуло
+    в кэш значение, прочитанное до фиксации. С USER_CACHE_BACKEND=postgres
+    остальные процессы узнают об изменении через NOTIFY — он доставляется
+    только после фиксации.
+    """
+    def _drop():
+        for tg_id in tg_ids:
+            user_cache.invalidate(tg_id)
+
+    _drop()
+    after_commit(_drop)
+    if config.USER_CACHE_BACKEND == "postgres":
+        # Полезная нагрузка NOTIFY ограничена 8000 байт
+        for i in range(0, len(tg_ids), 400):
+            await conn.execute(
+                "SELECT pg_notify(?, ?)", USER_CACHE_CHANNEL, ",".join(map(str, tg_ids[i:i + 400]))
+            )
+
+
+def _on_user_cache_notify(payload: str):
+    for tg_id in payload.split(","):
+        user_cache.invalidate(int(tg_id))
+
+
+async def listen_user_cache_invalidations():
+    """Подписывает процесс на сброс кэша users другими процессами (USER_CACHE_BACKEND=postgres)."""
+    if config.USER_CACHE_BACKEND == "local":
+        return
+    pool = await _get_pool()
+    if config.USER_CACHE_BACKEND != "postgres" or pool.dialect != "postgres":
+        raise ValueError("USER_CACHE_BACKEND=postgres требует DATABASE_URL на PostgreSQL")
+    await pool.listen(USER_CACHE_CHANNEL, _on_user_cache_notify)
+
+
+async def get_user(tg_id: int) -> Optional[dict]:
+    """Запись пользователя {"subscription_end", "in_group", "username"} или None; читается через кэш."""
+    async def _load():
+        async with _conn() as conn:
+            r = await conn.fetchrow(
+                "SELECT subscription_end, in_group, username FROM users WHERE tg_id = ?", tg_id
+            )
+        if r is None:
+            return None
+        return {"subscription_end": r[0], "in_group": bool(r[1]), "username": r[2]}
+
+    # Внутри транзакции читаем мимо кэша: она может видеть ещё не зафиксированные изменения
+    if _tx_conn.get() is not None:
+        return await _load()
+    return await user_cache.get_or_load(tg_id, _load)
+
+
+def on_subscription_change(listener: Callable[[int, datetime], None]):
+    """Регистрирует колбэк, вызываемый при продлении подписки и при входе участника в группу."""
+    _subscription_listeners.append(listener)
+
+
+def notify_subscription_change(tg_id: int, subscription_end: datetime):
+    """Передаёт новый дедлайн колбэкам on_subscription_change (после фиксации текущей транзакции).
+
+    Колбэки вызываются только в текущем процессе; другие воркеры увидят
+    дедлайн при перечитывании из БД (см. scheduler.SHARED_SCHEDULER_HORIZON).
+    """
+    for listener in _subscription_listeners:
+        after_commit(lambda listener=listener: listener(tg_id, subscription_end))
+
+
+async def is_user_in_group(tg_id: int) -> bool:
+    user = await get_user(tg_id)
+    return user["in_group"] if user else False
 
 
-def set_user_in_group(tg_id: int, in_group: bool):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET in_group = ? WHERE tg_id = ?", (1 if in_group else 0, tg_id))
-    conn.commit()
-    conn.close()
+async def get_users_in_group(tg_ids: list[int]) -> set[int]:
+    """Кто из tg_ids сейчас состоит в закрытой группе — одним запросом, мимо кэша."""
+    if not tg_ids:
+        return set()
+    ids = ",".join("?" * len(tg_ids))
+    async with _conn() as conn:
+        rows = await conn.fetch(f"SELECT tg_id FROM users WHERE in_group = 1 AND tg_id IN ({ids})", *tg_ids)
+    return {r["tg_id"] for r in rows}
 
 
-def get_user_subscription_end(tg_id: int):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("SELECT subscription_end FROM users WHERE tg_id = ?", (tg_id,))
-    r = cur.fetchone()
-    conn.close()
-    if r and r[0]:
-        return datetime.strptime(r[0], "%Y-%m-%d %H:%M:%S")
+async def set_user_in_group(tg_id: int, in_group: bool):
+    await set_users_in_group([tg_id], in_group)
+
+
+async def set_users_in_group(tg_ids: list[int], in_group: bool):
+    """Одним UPDATE выставляет in_group пачке пользователей."""
+    if not tg_ids:
+        return
+    placeholders = ",".join("?" * len(tg_ids))
+    async with _conn() as conn:
+        await conn.execute(
+            f"UPDATE users SET in_group = ? WHERE tg_id IN ({placeholders})", 1 if in_group else 0, *tg_ids
+        )
+        await _invalidate_users(conn, tg_ids)
+
+
+async def finish_kicks(tg_ids: list[int]):
+    """Снимает kick_pending: пользователь удалён из группы (или его там уже нет)."""
+    if not tg_ids:
+        return
+    placeholders = ",".join("?" * len(tg_ids))
+    async with _conn() as conn:
+        await conn.execute(f"UPDATE users SET kick_pending = 0 WHERE tg_id IN ({placeholders})", *tg_ids)
+        await _invalidate_users(conn, tg_ids)
+
+
+async def get_membership_candidates(after_tg_id: int, now: int, limit: int = 500):
+    """Страница (tg_id, in_group, kick_pending) для сверки членства с Telegram.
+
+    Проверяются те, кто числится в группе, должен в ней быть (активная подписка)
+    или не был из неё удалён после окончания подписки (kick_pending).
+    Keyset-пагинация по tg_id.
+    """
+    async with _conn() as conn:
+        return await conn.fetch("""
+            SELECT tg_id, in_group, kick_pending
+            FROM users
+            WHERE tg_id > ?
+              AND (in_group = 1 OR kick_pending = 1 OR subscription_end > ?)
+            ORDER BY tg_id
+            LIMIT ?
+        """, after_tg_id, now, limit)
+
+
+async def get_user_subscription_end(tg_id: int):
+    user = await get_user(tg_id)
+    if user and user["subscription_end"]:
+        return datetime.fromtimestamp(user["subscription_end"])
     return None
 
 
-def get_expired_subscriptions():
-    """Возвращает список (tg_id, username) для тех, у кого subscription_end < now и in_group = 1"""
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT tg_id, username
-        FROM users
-        WHERE datetime(subscription_end) < datetime('now')
-          AND in_group = 1
-    """)
-    res = cur.fetchall()
-    conn.close()
-    return res
-
-
-def get_users_expiring_in(days: int):
-    """Возвращает (tg_id, username, subscription_end, notify_flag) для пользователей, чья подписка кончается через `days`."""
-    conn = _conn()
-    cur = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    target = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
-
-    cur.execute("""
-        SELECT tg_id, username, subscription_end, notify_1_day
-        FROM users
-        WHERE datetime(subscription_end) BETWEEN datetime(?) AND datetime(?)
-    """, (now, target))
-    rows = cur.fetchall()
-    conn.close()
+async def claim_expired_subscriptions(limit: int = 500):
+    """Атомарно снимает in_group = 1 с пачки истёкших подписок и возвращает их (tg_id, username).
+
+    Каждая строка достаётся ровно одному вызывающему, даже если шедулер
+    по ошибке работает в нескольких процессах одновременно. До подтверждения
+    удаления из группы (finish_kicks) строка помечена kick_pending = 1 —
+    если процесс упадёт посреди пачки, её подберёт сверка членства.
+    """
+    async with _conn() as conn:
+        rows = await conn.fetch("""
+            UPDATE users
+            SET in_group = 0, kick_pending = 1
+            WHERE tg_id IN (
+                SELECT tg_id FROM users
+                WHERE in_group = 1
+                  AND subscription_end < ?
+                LIMIT ?
+            )
+              AND in_group = 1
+            RETURNING tg_id, username
+        """, int(time.time()), limit)
+        if rows:
+            await _invalidate_users(conn, [row[0] for row in rows])
     return rows
 
 
-def mark_user_notified_1_day(tg_id: int):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET notify_1_day = 1 WHERE tg_id = ?", (tg_id,))
-    conn.commit()
-    conn.close()
+async def get_subscription_deadlines(until: int):
+    """Возвращает (tg_id, subscription_end) участников группы, чья подписка кончается раньше `until` (epoch)."""
+    async with _conn() as conn:
+        return await conn.fetch("""
+            SELECT tg_id, subscription_end
+            FROM users
+            WHERE in_group = 1
+              AND subscription_end < ?
+        """, until)
+
+
+async def get_users_expiring_in(days: int, now: int, limit: int = 500):
+    """Пользователи, чья подписка кончается в ближайшие `days` дней и которым не отправлено нужное напоминание.
+
+    Возвращает (tg_id, username, subscription_end, notify_7_days, notify_1_day);
+    подписки старше суток без notify_1_day тоже попадают в выборку.
+    Диапазонный поиск по idx_users_subscription_end, subscription_end — unix epoch в секундах.
+    """
+    async with _conn() as conn:
+        return await conn.fetch("""
+            SELECT tg_id, username, subscription_end, notify_7_days, notify_1_day
+            FROM users
+            WHERE subscription_end > ? AND subscription_end <= ?
+              AND (notify_7_days = 0 OR (notify_1_day = 0 AND subscription_end <= ?))
+            ORDER BY subscription_end
+            LIMIT ?
+        """, now, now + days * 86400, now + 86400, limit)
+
+
+async def mark_users_notified(tg_ids: list[int], now: int):
+    """Одним запросом ставит флаги напоминаний пачке пользователей.
+
+    notify_7_days ставится всем, notify_1_day — тем, чья подписка кончается
+    в ближайшие сутки от `now` (тот же момент, что и в get_users_expiring_in).
+    """
+    if not tg_ids:
+        return
+    placeholders = ", ".join("?" * len(tg_ids))
+    async with _conn() as conn:
+        await conn.execute(f"""
+            UPDATE users
+            SET notify_7_days = 1,
+                notify_1_day = CASE WHEN subscription_end <= ? THEN 1 ELSE notify_1_day END
+            WHERE tg_id IN ({placeholders})
+        """, now + 86400, *tg_ids)
 
 
-def create_pending_payment(tg_id: int, username: str | None, plan: str, amount: int) -> int:
+# Статусы заявки, из которых её ещё можно подтвердить или отклонить
+OPEN_PAYMENT_STATUSES = ("pending", "awaiting_review")
+
+
+async def create_pending_payment(tg_id: int, username: str | None, plan: str, amount: int) -> int:
     """Создаёт (или обновляет существующий) pending payment."""
-    conn = _conn()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id FROM pending_payments WHERE tg_id = ? AND status IN ('pending','awaiting_review')", (tg_id,))
-    r = cur.fetchone()
-    if r:
-        pid = r[0]
-        cur.execute("""
-            UPDATE pending_payments
-            SET plan = ?, amount = ?, status = 'pending', proof_file_id = NULL, created_at = datetime('now')
-            WHERE id = ?
-        """, (plan, amount, pid))
-    else:
-        cur.execute("""
-            INSERT INTO pending_payments (tg_id, username, plan, amount, status)
-            VALUES (?, ?, ?, ?, 'pending')
-        """, (tg_id, username, plan, amount))
-        pid = cur.lastrowid
-
-    conn.commit()
-    conn.close()
+    async with transaction() as conn:
+        r = await conn.fetchrow(
+            "SELECT id FROM pending_payments WHERE tg_id = ? AND status IN ('pending','awaiting_review')", tg_id
+        )
+        if r:
+            pid = r[0]
+            await conn.execute("""
+                UPDATE pending_payments
+                SET plan = ?, amount = ?, status = 'pending', proof_file_id = NULL, created_at = ?
+                WHERE id = ?
+            """, plan, amount, _now_str(), pid)
+        else:
+            pid = await conn.fetchval("""
+                INSERT INTO pending_payments (tg_id, username, plan, amount, status, created_at)
+                VALUES (?, ?, ?, ?, 'pending', ?)
+                RETURNING id
+            """, tg_id, username, plan, amount, _now_str())
+
     return pid
 
 
-def get_pending_by_user(tg_id: int) -> Optional[dict]:
-    conn = _conn()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, tg_id, username, plan, amount, status, proof_file_id, created_at
-        FROM pending_payments
-        WHERE tg_id = ?
-        ORDER BY id DESC
-        LIMIT 1
-    """, (tg_id,))
-    r = cur.fetchone()
-    conn.close()
+async def get_pending_by_user(tg_id: int) -> Optional[dict]:
+    async with _conn() as conn:
+        r = await conn.fetchrow("""
+            SELECT id, tg_id, username, plan, amount, status, proof_file_id, created_at
+            FROM pending_payments
+            WHERE tg_id = ?
+            ORDER BY id DESC
+            LIMIT 1
+        """, tg_id)
     if not r:
         return None
     return dict(r)
 
 
-def get_pending_by_id(pid: int) -> Optional[dict]:
-    conn = _conn()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM pending_payments WHERE id = ?", (pid,))
-    r = cur.fetchone()
-    conn.close()
+async def get_pending_by_id(pid: int) -> Optional[dict]:
+    async with _conn() as conn:
+        r = await conn.fetchrow("SELECT * FROM pending_payments WHERE id = ?", pid)
     return dict(r) if r else None
 
 
-def set_pending_proof(payment_id: int, file_id: str):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE pending_payments SET proof_file_id = ?, status = 'awaiting_review' WHERE id = ?",
-                (file_id, payment_id))
-    conn.commit()
-    conn.close()
+async def set_pending_proof(payment_id: int, file_id: str) -> bool:
+    """Прикладывает чек; False — заявка уже подтверждена, отклонена или отменена."""
+    async with _conn() as conn:
+        return await conn.execute("""
+            UPDATE pending_payments SET proof_file_id = ?, status = 'awaiting_review'
+            WHERE id = ? AND status IN ('pending', 'awaiting_review')
+        """, file_id, payment_id) > 0
 
 
-def set_pending_status(payment_id: int, status: str, admin_id: int | None = None, admin_note: str | None = None):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE pending_payments SET status = ?, admin_id = ?, admin_note = ? WHERE id = ?",
-                (status, admin_id, admin_note, payment_id))
-    conn.commit()
-    conn.close()
+async def set_pending_status(payment_id: int, status: str, admin_id: int | None = None,
+                             admin_note: str | None = None,
+                             expected: tuple[str, ...] = OPEN_PAYMENT_STATUSES) -> bool:
+    """Compare-and-set: меняет статус, только если текущий входит в `expected`.
 
+    Возвращает False, если заявку уже обработали (например, второе нажатие
+    «Подтвердить» или другой воркер).
+    """
+    placeholders = ",".join("?" * len(expected))
+    async with _conn() as conn:
+        return await conn.execute(f"""
+            UPDATE pending_payments SET status = ?, admin_id = ?, admin_note = ?
+            WHERE id = ? AND status IN ({placeholders})
+        """, status, admin_id, admin_note, payment_id, *expected) > 0
 
-def delete_pending_by_user(tg_id: int):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM pending_payments WHERE tg_id = ? AND status IN ('pending','awaiting_review')", (tg_id,))
-    conn.commit()
-    conn.close()
 
+async def set_pending_statuses(payment_ids: list[int], status: str, admin_id: int | None = None,
+                               expected: tuple[str, ...] = OPEN_PAYMENT_STATUSES) -> list[dict]:
+    """Пакетный compare-and-set одним UPDATE; возвращает заявки, статус которых сменился.
+
+    Уже обработанные заявки из `payment_ids` в результат не попадают.
+    """
+    if not payment_ids:
+        return []
+    ids = ",".join("?" * len(payment_ids))
+    placeholders = ",".join("?" * len(expected))
+    async with _conn() as conn:
+        rows = await conn.fetch(f"""
+            UPDATE pending_payments SET status = ?, admin_id = ?
+            WHERE id IN ({ids}) AND status IN ({placeholders})
+            RETURNING id, tg_id, username, plan, amount
+        """, status, admin_id, *payment_ids, *expected)
+    return sorted((dict(r) for r in rows), key=lambda r: r["id"])
+
+
+async def get_pendings_by_ids(payment_ids: list[int]) -> list[dict]:
+    if not payment_ids:
+        return []
+    ids = ",".join("?" * len(payment_ids))
+    async with _conn() as conn:
+        rows = await conn.fetch(f"SELECT * FROM pending_payments WHERE id IN ({ids}) ORDER BY id", *payment_ids)
+    return [dict(r) for r in rows]
+
+
+async def get_review_page(after_id: int, limit: int) -> list[dict]:
+    """Страница очереди проверки: заявки с чеком (awaiting_review) с id > after_id по возрастанию id.
+
+    Keyset-пагинация по индексу (status, id): стоимость страницы не зависит от её номера.
+    """
+    async with _conn() as conn:
+        rows = await conn.fetch("""
+            SELECT id, tg_id, username, plan, amount, created_at
+            FROM pending_payments
+            WHERE status = 'awaiting_review' AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, after_id, limit)
+    return [dict(r) for r in rows]
 
-def save_agreement(tg_id: int, username: str | None, offer_type: str, offer_version: str = "v1"):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO agreements (tg_id, username, offer_type, offer_version, accepted_at)
-        VALUES (?, ?, ?, ?, ?)
-    """, (tg_id, username, offer_type, offer_version, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
 
+async def count_review_queue() -> int:
+    async with _conn() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM pending_payments WHERE status = 'awaiting_review'")
 
-def save_invite_link(tg_id: int, invite_link: str):
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO invite_links (tg_id, invite_link) VALUES (?, ?)", (tg_id, invite_link))
-    conn.commit()
-    conn.close()
+
+async def get_export_page(table: str, key: str, columns: tuple[str, ...], after, limit: int,
+                          date_column: str | None = None, date_from=None, date_to=None):
+    """Страница выгрузки (exports.py): строки (key, *columns) с key > after по возрастанию key.
+
+    Имена таблицы и колонок подставляются в SQL как есть — только из описаний в exports.EXPORTS.
+    Границы дат: date_from включительно, date_to не включительно.
+    """
+    where, args = [], []
+    if after is not None:
+        where.append(f"{key} > ?")
+        args.append(after)
+    if date_column and date_from is not None:
+        where.append(f"{date_column} >= ?")
+        args.append(date_from)
+    if date_column and date_to is not None:
+        where.append(f"{date_column} < ?")
+        args.append(date_to)
+    sql = f"SELECT {key}, {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {key} LIMIT ?"
+    async with _conn() as conn:
+        return await conn.fetch(sql, *args, limit)
+
+
+async def save_invite_link(tg_id: int, invite_link: str, expire_at: int | None = None):
+    async with _conn() as conn:
+        await conn.execute("""
+            INSERT INTO invite_links (tg_id, invite_link, used, expire_at, issued_at)
+            VALUES (?, ?, 1, ?, ?)
+        """, tg_id, invite_link, expire_at, int(time.time()))
+
+
+# ===== Пул заранее созданных ссылок-приглашений (invite_pool) =====
+
+async def add_pool_invite_links(links: list[tuple[str, int]]):
+    """Добавляет в пул свободные ссылки (invite_link, expire_at)."""
+    async with _conn() as conn:
+        await conn.executemany(
+            "INSERT INTO invite_links (invite_link, used, expire_at, created_at) VALUES (?, 0, ?, ?)",
+            [(link, expire_at, _now_str()) for link, expire_at in links],
+        )
+
+
+async def count_free_invite_links(min_expire_at: int) -> int:
+    async with _conn() as conn:
+        return await conn.fetchval(
+            "SELECT COUNT(*) FROM invite_links WHERE used = 0 AND expire_at > ?", min_expire_at
+        )
+
+
+async def claim_invite_link(tg_id: int, min_expire_at: int, attempts: int = 3) -> str | None:
+    """Атомарно выдаёт пользователю свободную ссылку, действующую дольше `min_expire_at`."""
+    async with _conn() as conn:
+        for _ in range(attempts):
+            # Параллельный вызов мог забрать ту же строку — тогда пробуем снова
+            link = await conn.fetchval("""
+                UPDATE invite_links
+                SET tg_id = ?, used = 1, issued_at = ?
+                WHERE id = (
+                    SELECT id FROM invite_links
+                    WHERE used = 0 AND expire_at > ?
+                    ORDER BY expire_at
+                    LIMIT 1
+                )
+                  AND used = 0
+                RETURNING invite_link
+            """, tg_id, int(time.time()), min_expire_at)
+            if link:
+                return link
+    return None
+
+
+async def take_stale_invite_links(min_expire_at: int) -> list[str]:
+    """Удаляет из пула свободные ссылки, истекающие раньше `min_expire_at`, и возвращает их для отзыва."""
+    async with _conn() as conn:
+        rows = await conn.fetch(
+            "DELETE FROM invite_links WHERE used = 0 AND expire_at <= ? RETURNING invite_link", min_expire_at
+        )
+    return [row[0] for row in rows]
 
 
 # ===== Логика для чеков и платежей =====
 
-_receipt_waiting: dict[int, dict[str, str]] = {}
+async def save_receipt_file(pid: int, file_id: str) -> bool:
+    """Сохраняет file_id чека и переводит заявку в статус 'awaiting_review'"""
+    return await set_pending_proof(pid, file_id)
 
 
-def set_receipt_waiting(user_id: int, pid: str | None, plan: str | None = None):
-    """
-    Устанавливает, что пользователь ожидает прикрепления чека.
-    Если pid=None — снимает ожидание.
-    """
-    global _receipt_waiting
-    if pid is None:
-        _receipt_waiting.pop(user_id, None)
-    else:
-        _receipt_waiting[user_id] = {"pid": pid, "plan": plan}
+async def get_payment(pid: int) -> Optional[dict]:
+    """Возвращает информацию о pending payment по id"""
+    return await get_pending_by_id(pid)
+
 
+async def update_payment_contacts(pid: int, phone: str, email: str):
+    """Обновляет контактные данные в записи платежа"""
+    async with _conn() as conn:
+        await conn.execute("UPDATE pending_payments SET phone = ?, email = ? WHERE id = ?", phone, email, pid)
 
-def get_receipt_waiting(user_id: int) -> dict | None:
+
+# ===== Хранилище FSM-состояний (fsm_storage.DBStorage) =====
+
+async def get_fsm_record(key: str, now: int):
+    """Возвращает (state, data) непросроченной записи FSM или None."""
+    async with _conn() as conn:
+        return await conn.fetchrow(
+            "SELECT state, data FROM fsm_states WHERE key = ? AND expires_at > ?", key, now
+        )
+
+
+async def save_fsm_record(key: str, state: str | None, data: str, expires_at: int):
+    async with _conn() as conn:
+        await conn.execute("""
+            INSERT INTO fsm_states (key, state, data, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE
+            SET state = excluded.state, data = excluded.data, expires_at = excluded.expires_at
+        """, key, state, data, expires_at)
+
+
+async def delete_fsm_record(key: str):
+    async with _conn() as conn:
+        await conn.execute("DELETE FROM fsm_states WHERE key = ?", key)
+
+
+async def prune_fsm_records(now: int):
+    async with _conn() as conn:
+        await conn.execute("DELETE FROM fsm_states WHERE expires_at <= ?", now)
+
+
+# ===== Идемпотентность: уже обработанные апдейты и платежи =====
+
+async def claim_processed(key: str) -> bool:
+    """Отмечает событие `key` обработанным; False — его уже обработали раньше.
+
+    Внутри transaction() отметка фиксируется вместе с результатом обработки.
     """
-    Возвращает данные pending заявки, для которой пользователь должен прикрепить чек.
+    async with _conn() as conn:
+        return await conn.execute("""
+            INSERT INTO processed_updates (key, processed_at) VALUES (?, ?)
+            ON CONFLICT (key) DO NOTHING
+        """, key, int(time.time())) > 0
+
+
+async def is_processed(key: str) -> bool:
+    async with _conn() as conn:
+        return await conn.fetchval("SELECT 1 FROM processed_updates WHERE key = ?", key) is not None
+
+
+async def release_processed(key: str):
+    """Снимает отметку, чтобы повторная доставка события обработала его заново."""
+    async with _conn() as conn:
+        await conn.execute("DELETE FROM processed_updates WHERE key = ?", key)
+
+
+async def prune_processed(before: int) -> int:
+    async with _conn() as conn:
+        return await conn.execute("DELETE FROM processed_updates WHERE processed_at < ?", before)
+
+
+# ===== Аренда (lease) для выбора ведущего процесса =====
+
+async def try_acquire_lease(name: str, holder: str, ttl: int) -> bool:
+    """Захватывает или продлевает lease `name`, если он свободен, просрочен или уже наш."""
+    now = int(time.time())
+    async with _conn() as conn:
+        row = await conn.fetchrow("""
+            INSERT INTO leases (name, holder, expires_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE
+            SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            RETURNING holder
+        """, name, holder, now + ttl, now)
+    return row is not None
+
+
+async def release_lease(name: str, holder: str):
+    async with _conn() as conn:
+        await conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", name, holder)
+
+
+async def get_lease_holders() -> list[str]:
+    """Процессы, держащие хотя бы один непросроченный lease."""
+    async with _conn() as conn:
+        rows = await conn.fetch("SELECT DISTINCT holder FROM leases WHERE expires_at >= ?", int(time.time()))
+    return [row[0] for row in rows]
+
+
+# ===== Очередь исходящих сообщений (outbox) =====
+
+async def enqueue_outbox(chat_id: int, method: str, payload: str,
+                         fallback_method: str | None = None, fallback_payload: str | None = None):
+    """Добавляет вызов Bot API в очередь; внутри transaction() — атомарно с остальными изменениями."""
+    now = int(time.time())
+    async with _conn() as conn:
+        await conn.execute("""
+            INSERT INTO outbox (chat_id, method, payload, fallback_method, fallback_payload, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, chat_id, method, payload, fallback_method, fallback_payload, now, now)
+
+
+async def enqueue_outbox_many(rows: list[tuple[int, str, str]]):
+    """Пакетная постановка в очередь: строки (chat_id, method, payload) без запасного вызова."""
+    now = int(time.time())
+    async with _conn() as conn:
+        await conn.executemany("""
+            INSERT INTO outbox (chat_id, method, payload, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(chat_id, method, payload, now, now) for chat_id, method, payload in rows])
+
+
+async def get_due_outbox(now: int, limit: int = 100):
+    """Сообщения, готовые к отправке, в порядке постановки в очередь.
+
+    Сообщение пропускается, если более раннее сообщение в тот же чат ждёт
+    повторной попытки, — так сохраняется порядок доставки внутри чата.
     """
-    return _receipt_waiting.get(user_id)
+    async with _conn() as conn:
+        return await conn.fetch("""
+            SELECT id, chat_id, method, payload, fallback_method, attempts
+            FROM outbox o
+            WHERE status = 'pending' AND next_attempt_at <= ?
+              AND NOT EXISTS (
+                SELECT 1 FROM outbox p
+                WHERE p.chat_id = o.chat_id AND p.id < o.id
+                  AND p.status = 'pending' AND p.next_attempt_at > ?
+              )
+            ORDER BY id
+            LIMIT ?
+        """, now, now, limit)
+
+
+async def delete_outbox(ids: list[int]):
+    """Удаляет доставленные сообщения."""
+    async with _conn() as conn:
+        await conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+
+async def retry_outbox(outbox_id: int, attempts: int, next_attempt_at: int, error: str):
+    async with _conn() as conn:
+        await conn.execute("""
+            UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?
+            WHERE id = ?
+        """, attempts, next_attempt_at, error, outbox_id)
 
 
-def save_receipt_file(pid: int, file_id: str):
-    """Сохраняет file_id чека и переводит заявку в статус 'awaiting_review'"""
-    set_pending_proof(pid, file_id)
+async def use_outbox_fallback(outbox_id: int, error: str):
+    """Заменяет отклонённый вызов запасным; он уйдёт при следующем проходе."""
+    async with _conn() as conn:
+        await conn.execute("""
+            UPDATE outbox
+            SET method = fallback_method, payload = fallback_payload,
+                fallback_method = NULL, fallback_payload = NULL, last_error = ?
+            WHERE id = ?
+        """, error, outbox_id)
 
 
-def set_payment_status(pid: int, status: str):
-    """Меняет статус pending payment на approved/rejected"""
-    set_pending_status(pid, status)
+async def fail_outbox(outbox_id: int, error: str):
+    """Помечает сообщение недоставляемым; оно остаётся в таблице для разбора."""
+    async with _conn() as conn:
+        await conn.execute(
+            "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", error, outbox_id
+        )
 
 
-def get_payment(pid: int) -> Optional[dict]:
-    """Возвращает информацию о pending payment по id"""
-    return get_pending_by_id(pid)
+# ===== События для сводки админу (admin_digest.py) =====
 
+async def add_admin_event(kind: str, text: str, tg_id: int | None, username: str | None):
+    async with _conn() as conn:
+        await conn.execute("""
+            INSERT INTO admin_events (kind, text, tg_id, username, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, kind, text, tg_id, username, int(time.time()))
 
-_contacts_waiting: dict[int, dict[str, str]] = {}
 
+async def get_admin_events(limit: int) -> list[dict]:
+    """Самые старые неотправленные события; удаляются только после успешной отправки сводки."""
+    async with _conn() as conn:
+        rows = await conn.fetch("SELECT * FROM admin_events ORDER BY id LIMIT ?", limit)
+    return [dict(r) for r in rows]
 
-def set_contacts_waiting(user_id: int, pid: str):
-    """Устанавливает состояние ожидания контактных данных"""
-    global _contacts_waiting
-    _contacts_waiting[user_id] = {"pid": pid}
 
+async def delete_admin_events(ids: list[int]):
+    async with _conn() as conn:
+        await conn.executemany("DELETE FROM admin_events WHERE id = ?", [(i,) for i in ids])
 
-def get_contacts_waiting(user_id: int):
-    """Получает информацию об ожидании контактов"""
-    return _contacts_waiting.get(user_id)
 
+# ===== Рассылки (broadcast.py) =====
 
-def update_payment_contacts(pid: int, phone: str, email: str):
-    """Обновляет контактные данные в записи платежа"""
-    conn = _conn()
-    cur = conn.cursor()
-    try:
-        cur.execute("ALTER TABLE pending_payments ADD COLUMN phone TEXT")
-        cur.execute("ALTER TABLE pending_payments ADD COLUMN email TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    cur.execute("UPDATE pending_payments SET phone = ?, email = ? WHERE id = ?", (phone, email, pid))
-    conn.commit()
-    conn.close()
-
-
-def clear_user_state(user_id: int):
-    """Очищает состояние пользователя"""
-    global _receipt_waiting, _contacts_waiting
-    _receipt_waiting.pop(user_id, None)
-    _contacts_waiting.pop(user_id, None)
+async def create_broadcast(admin_id: int, from_chat_id: int, message_id: int) -> int:
+    async with _conn() as conn:
+        return await conn.fetchval("""
+            INSERT INTO broadcasts (admin_id, from_chat_id, message_id, created_at)
+            VALUES (?, ?, ?, ?)
+            RETURNING id
+        """, admin_id, from_chat_id, message_id, int(time.time()))
+
+
+async def get_broadcast(broadcast_id: int) -> Optional[dict]:
+    async with _conn() as conn:
+        row = await conn.fetchrow("SELECT * FROM broadcasts WHERE id = ?", broadcast_id)
+    return dict(row) if row else None
+
+
+async def get_running_broadcasts() -> list[dict]:
+    async with _conn() as conn:
+        rows = await conn.fetch("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+    return [dict(r) for r in rows]
+
+
+async def get_broadcast_recipients(after_tg_id: int, now: int, limit: int) -> list[int]:
+    """Следующая страница активных подписчиков по возрастанию tg_id (keyset-пагинация)."""
+    async with _conn() as conn:
+        rows = await conn.fetch("""
+            SELECT tg_id FROM users
+            WHERE tg_id > ? AND subscription_end > ?
+            ORDER BY tg_id
+            LIMIT ?
+        """, after_tg_id, now, limit)
+    return [row[0] for row in rows]
+
+
+async def save_broadcast_progress(broadcast_id: int, last_tg_id: int, delivered: int, blocked: int, failed: int):
+    """Сдвигает контрольную точку рассылки и прибавляет счётчики за страницу."""
+    async with _conn() as conn:
+        await conn.execute("""
+            UPDATE broadcasts
+            SET last_tg_id = ?, delivered = delivered + ?, blocked = blocked + ?, failed = failed + ?
+            WHERE id = ?
+        """, last_tg_id, delivered, blocked, failed, broadcast_id)
+
+
+async def finish_broadcast(broadcast_id: int, status: str) -> bool:
+    """Завершает рассылку (done / cancelled), если она ещё выполняется."""
+    async with _conn() as conn:
+        return await conn.execute("""
+            UPDATE broadcasts SET status = ?, finished_at = ?
+            WHERE id = ? AND status = 'running'
+        """, status, int(time.time()), broadcast_id) > 0
+
+
+# Время и ошибки всех публичных корутин db.* — в metrics (bot_db_call_duration_seconds)
+for _name, _fn in list(globals().items()):
+    if not _name.startswith("_") and inspect.iscoroutinefunction(_fn) and _fn.__module__ == __name__:
+        globals()[_name] = metrics.timed_db(_name)(_fn)
@@ -0,0 +1,215 @@
+# exports.py
+"""Потоковые выгрузки таблиц для админа в CSV и XLSX.
+
+Строки читаются из БД страницами по EXPORT_CHUNK_SIZE (keyset по ключу таблицы)
+и сразу дописываются во временный файл, поэтому память не зависит от размера
+таблицы. CSV больше GZIP_THRESHOLD сжимается в .csv.gz; XLSX — это zip-архив
+и отдельно не сжимается. Файл удаляет вызывающий после отправки.
+"""
+import asyncio
+import csv
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator
+from xml.sax.saxutils import escape
+
+import db
+
+EXPORT_CHUNK_SIZE = 1000
+GZIP_THRESHOLD = 5 * 1024 * 1024
+
+FORMATS = ("csv", "xlsx")
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    title: str
+    table: str
+    key: str
+    columns: tuple[str, ...]
+    date_column: str
+    # Колонка даты хранит unix epoch (users.subscription_end), а не строку '%Y-%m-%d %H:%M:%S'
+    date_is_epoch: bool = False
+
+
+EXPORTS = {
+    "agreements": ExportSpec(
+        "📑 Акцепты оферт", "agreements", "id",
+        ("tg_id", "username", "offer_type", "offer_version", "accepted_at"),
+        "accepted_at",
+    ),
+    "payments": ExportSpec(
+        "💳 Заявки на оплату", "pending_payments", "id",
+        ("id", "tg_id", "username", "plan", "amount", "status", "created_at",
+         "admin_id", "admin_note", "phone", "email"),
+        "created_at",
+    ),
+    "users": ExportSpec(
+        "👥 Пользователи", "users", "tg_id",
+        ("tg_id", "username", "subscription_end", "in_group"),
+        "subscription_end", date_is_epoch=True,
+    ),
+}
+
+
+def _date_bound(spec: ExportSpec, day: date | None):
+    if day is None:
+        return None
+    moment = datetime(day.year, day.month, day.day)
+    return int(moment.timestamp()) if spec.date_is_epoch else moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def stream_rows(spec: ExportSpec, date_from: date | None = None,
+                      date_to: date | None = None) -> AsyncIterator[list[tuple]]:
+    """Отдаёт строки выгрузки пачками; date_to включается целиком."""
+    lower = _date_bound(spec, date_from)
+    upper = _date_bound(spec, date_to + timedelta(days=1) if date_to else None)
+    date_index = spec.columns.index(spec.date_column)
+    after = None
+    while True:
+        page = await db.get_export_page(
+            spec.table, spec.key, spec.columns, after, EXPORT_CHUNK_SIZE, spec.date_column, lower, upper
+        )
+        if not page:
+            return
+        after = page[-1][0]
+        rows = [tuple(row)[1:] for row in page]
+        if spec.date_is_epoch:
+            rows = [
+                row[:date_index]
+                + (datetime.fromtimestamp(row[date_index]).strftime("%Y-%m-%d %H:%M:%S") if row[date_index] else None,)
+                + row[date_index + 1:]
+                for row in rows
+            ]
+        yield rows
+
+
+class _CsvWriter:
+    def __init__(self, path: str, header: tuple[str, ...]):
+        # utf-8-sig — чтобы Excel открыл кириллицу без выбора кодировки
+        self._file = open(path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(header)
+
+    def write(self, rows: list[tuple]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="export" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Управляющие символы, недопустимые в XML 1.0
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+class _XlsxWriter:
+    """Минимальный XLSX без зависимостей: один лист, строки пишутся потоком в zip."""
+
+    def __init__(self, path: str, header: tuple[str, ...]):
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        for name, content in _XLSX_STATIC.items():
+            self._zip.writestr(name, content)
+        self._sheet = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        self.write([header])
+
+    def write(self, rows: list[tuple]):
+        self._sheet.write("".join(
+            "<row>" + "".join(_xlsx_cell(v) for v in row) + "</row>" for row in rows
+        ).encode("utf-8"))
+
+    def close(self):
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._zip.close()
+
+
+def _gzip_file(path: str) -> str:
+    gz_path = path + ".gz"
+    with open(path, "rb") as src, gzip.open(gz_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+    return gz_path
+
+
+async def export(name: str, fmt: str = "csv", date_from: date | None = None,
+                 date_to: date | None = None) -> tuple[str, str, int]:
+    """Выгружает EXPORTS[name] во временный файл; возвращает (путь, имя для отправки, число строк)."""
+    spec = EXPORTS[name]
+    writer_cls = {"csv": _CsvWriter, "xlsx": _XlsxWriter}[fmt]
+    fd, path = tempfile.mkstemp(prefix=f"export_{name}_", suffix=f".{fmt}")
+    os.close(fd)
+
+    count = 0
+    try:
+        writer = await asyncio.to_thread(writer_cls, path, spec.columns)
+        try:
+            async for rows in stream_rows(spec, date_from, date_to):
+                await asyncio.to_thread(writer.write, rows)
+                count += len(rows)
+        finally:
+            await asyncio.to_thread(writer.close)
+
+        filename = f"{name}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}"
+        if fmt == "csv" and os.path.getsize(path) > GZIP_THRESHOLD:
+            path = await asyncio.to_thread(_gzip_file, path)
+            filename += ".gz"
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, filename, count
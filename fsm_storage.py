@@ -0,0 +1,160 @@
+# fsm_storage.py
+"""Хранилища FSM-состояний aiogram с ограниченным временем жизни.
+
+TTLMemoryStorage — LRU в памяти процесса: не больше FSM_MEMORY_MAX_SIZE записей,
+каждая живёт FSM_STATE_TTL секунд с последней записи.
+DBStorage — таблица fsm_states в основной БД (SQLite/PostgreSQL): состояние
+переживает перезапуск и общее для нескольких процессов бота.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+import config
+import db
+
+logger = logging.getLogger(__name__)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+def _check_data(data: Mapping[str, Any]):
+    if not isinstance(data, dict):
+        raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+
+class TTLMemoryStorage(BaseStorage):
+    """LRU-хранилище в памяти с вытеснением по размеру и по TTL."""
+
+    def __init__(self, ttl: int, max_size: int, key_builder: KeyBuilder | None = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._records: OrderedDict[str, _Record] = OrderedDict()
+
+    def _get(self, key: StorageKey) -> _Record | None:
+        k = self.key_builder.build(key)
+        record = self._records.get(k)
+        if record is None:
+            return None
+        if record.expires_at <= time.monotonic():
+            del self._records[k]
+            return None
+        self._records.move_to_end(k)
+        return record
+
+    def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        k = self.key_builder.build(key)
+        if state is None and not data:
+            self._records.pop(k, None)
+            return
+        self._records[k] = _Record(state, data, time.monotonic() + self.ttl)
+        self._records.move_to_end(k)
+        while len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get(key)
+        self._put(key, _state_name(state), record.data if record else {})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        _check_data(data)
+        record = self._get(key)
+        self._put(key, record.state if record else None, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def prune(self):
+        """Удаляет записи с истёкшим TTL."""
+        now = time.monotonic()
+        for k in [k for k, r in self._records.items() if r.expires_at <= now]:
+            del self._records[k]
+
+    async def close(self) -> None:
+        self._records.clear()
+
+
+class DBStorage(BaseStorage):
+    """Хранилище в таблице fsm_states основной БД."""
+
+    def __init__(self, ttl: int, key_builder: KeyBuilder | None = None):
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def _get(self, key: StorageKey) -> tuple[Optional[str], Dict[str, Any]]:
+        row = await db.get_fsm_record(self.key_builder.build(key), int(time.time()))
+        if row is None:
+            return None, {}
+        return row["state"], json.loads(row["data"]) if row["data"] else {}
+
+    async def _put(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        k = self.key_builder.build(key)
+        if state is None and not data:
+            await db.delete_fsm_record(k)
+            return
+        await db.save_fsm_record(k, state, json.dumps(data, ensure_ascii=False), int(time.time()) + self.ttl)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get(key)
+        await self._put(key, _state_name(state), data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        _check_data(data)
+        state, _ = await self._get(key)
+        await self._put(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        return data
+
+    async def prune(self):
+        await db.prune_fsm_records(int(time.time()))
+
+    async def close(self) -> None:
+        pass
+
+
+def create_storage() -> TTLMemoryStorage | DBStorage:
+    """Создаёт хранилище по config.FSM_STORAGE: "memory" или "db"."""
+    if config.FSM_STORAGE == "db":
+        return DBStorage(ttl=config.FSM_STATE_TTL)
+    if config.FSM_STORAGE == "memory":
+        return TTLMemoryStorage(ttl=config.FSM_STATE_TTL, max_size=config.FSM_MEMORY_MAX_SIZE)
+    raise ValueError(f"Неизвестный FSM_STORAGE: {config.FSM_STORAGE!r}")
+
+
+async def run_pruner(storage: TTLMemoryStorage | DBStorage, interval: int = 600):
+    """Периодически удаляет просроченные состояния."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await storage.prune()
+        except Exception as e:
+            logger.error(f"Ошибка очистки FSM-состояний: {e}")
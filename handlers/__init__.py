@@ -1,8 +1,14 @@
-from . import start, payment, subscription, admin
+import callbacks
+
+from . import start, payment, subscription, admin, review, membership
 
 routers = [
+    # Все нажатия на inline-кнопки разбирает callbacks.router по префиксу callback_data
+    callbacks.router,
     start.router,
     admin.router,
+    review.router,
     payment.router,
     subscription.router,
+    membership.router,
 ]
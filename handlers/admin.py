@@ -1,36 +1,132 @@
-import sqlite3
-import csv
-from aiogram import Router
-from aiogram.filters import Command
-from aiogram.types import Message, FSInputFile
+import os
+from datetime import date, datetime
+
+from aiogram import Bot, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import CallbackQuery, Message, FSInputFile
+import broadcast
+import callbacks
 import config
+import db
+import exports
+from callbacks import Export
+from ratelimit import call_with_retry, request_limiter
 
 router = Router()
 
 
-@router.callback_query(lambda c: c.data == "agreements")
-async def agreements_handler(message: Message):
+EXPORT_USAGE = (
+    "📤 Выгрузка: /export <таблица> [csv|xlsx] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД]\n\n"
+    "Таблицы: agreements, payments, users\n"
+    "Например: /export payments xlsx 2025-01-01 2025-01-31"
+)
+
+
+async def send_export(bot: Bot, chat_id: int, name: str, fmt: str = "csv",
+                      date_from: date | None = None, date_to: date | None = None):
+    """Формирует выгрузку во временный файл, отправляет его и удаляет."""
+    path, filename, count = await exports.export(name, fmt, date_from, date_to)
+    try:
+        if not count:
+            await bot.send_message(chat_id, "Нет данных за выбранный период.")
+            return
+        await call_with_retry(
+            chat_id, bot.send_document,
+            chat_id,
+            FSInputFile(path, filename=filename),
+            caption=f"{exports.EXPORTS[name].title}: {count} строк",
+            limiter=request_limiter,
+        )
+    finally:
+        os.remove(path)
+
+
+@callbacks.on(Export)
+async def export_callback_handler(callback: CallbackQuery, callback_data: Export):
+    if callback.from_user.id != config.ADMIN_ID:
+        return await callback.answer("❌ У вас нет прав для этой команды.", show_alert=True)
+    if callback_data.name not in exports.EXPORTS:
+        return await callback.answer("Неизвестная выгрузка.", show_alert=True)
+
+    await callback.answer("⏳ Готовлю выгрузку…")
+    await send_export(callback.bot, callback.from_user.id, callback_data.name)
+
+
+@router.message(Command("export"))
+async def export_handler(message: Message, command: CommandObject):
     if message.from_user.id != config.ADMIN_ID:
         return await message.answer("❌ У вас нет прав для этой команды.")
 
-    conn = sqlite3.connect("bot.db")
-    cur = conn.cursor()
-    cur.execute("SELECT tg_id, username, offer_type, offer_version, accepted_at FROM agreements")
-    rows = cur.fetchall()
-    conn.close()
+    args = (command.args or "").split()
+    if not args or args[0] not in exports.EXPORTS:
+        return await message.answer(EXPORT_USAGE)
+    name, args = args[0], args[1:]
+    fmt = args.pop(0) if args and args[0] in exports.FORMATS else "csv"
+    try:
+        dates = [datetime.strptime(a, "%Y-%m-%d").date() for a in args[:2]]
+    except ValueError:
+        return await message.answer(EXPORT_USAGE)
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+
+    await message.answer("⏳ Готовлю выгрузку…")
+    await send_export(message.bot, message.chat.id, name, fmt, date_from, date_to)
+
 
-    # сохраняем во временный CSV
-    filename = "agreements.csv"
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["tg_id", "username", "offer_type", "offer_version", "accepted_at"])
-        writer.writerows(rows)
+@router.message(Command("cache_stats"))
+async def cache_stats_handler(message: Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return await message.answer("❌ У вас нет прав для этой команды.")
 
-    file = FSInputFile(filename)
-    await message.answer_document(file, caption="📑 Список акцептов оферт")
+    stats = db.user_cache.stats()
+    await message.answer(
+        "🗄 Кэш пользователей\n\n"
+        f"Записей: {stats['size']} из {stats['max_size']}\n"
+        f"Попадания: {stats['hits']}, промахи: {stats['misses']} ({stats['hit_rate']:.1%})\n"
+        f"Вытеснено: {stats['evictions']}, сброшено: {stats['invalidations']}"
+    )
 
 
 @router.message(Command("get_id"))
 async def get_id_handler(message: Message):
     chat_id = message.chat.id
     await message.answer(f"ID этой группы: {chat_id}")
+
+
+@router.message(Command("broadcast"))
+async def broadcast_handler(message: Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return await message.answer("❌ У вас нет прав для этой команды.")
+
+    if not message.reply_to_message:
+        return await message.answer(
+            "📣 Ответьте командой /broadcast на сообщение, которое нужно разослать всем активным подписчикам."
+        )
+
+    broadcast_id = await broadcast.start_broadcast(
+        message.from_user.id, message.chat.id, message.reply_to_message.message_id
+    )
+    await message.answer(
+        f"📣 Рассылка #{broadcast_id} запущена. По окончании придёт отчёт.\n\n"
+        f"Прогресс: /broadcast_status {broadcast_id}\n"
+        f"Остановить: /broadcast_cancel {broadcast_id}"
+    )
+
+
+@router.message(Command("broadcast_status", "broadcast_cancel"))
+async def broadcast_control_handler(message: Message, command: CommandObject):
+    if message.from_user.id != config.ADMIN_ID:
+        return await message.answer("❌ У вас нет прав для этой команды.")
+
+    try:
+        broadcast_id = int(command.args)
+    except (TypeError, ValueError):
+        return await message.answer(f"Укажите номер рассылки: /{command.command} 1")
+
+    if command.command == "broadcast_cancel":
+        await db.finish_broadcast(broadcast_id, "cancelled")
+
+    current = await db.get_broadcast(broadcast_id)
+    if current is None:
+        return await message.answer("Рассылка не найдена.")
+    await message.answer(broadcast.format_report(current))
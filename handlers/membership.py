@@ -0,0 +1,46 @@
+import logging
+from datetime import datetime
+
+from aiogram import Bot, F, Router
+from aiogram.enums import ChatMemberStatus
+from aiogram.filters import JOIN_TRANSITION, LEAVE_TRANSITION, ChatMemberUpdatedFilter
+from aiogram.types import ChatMemberUpdated
+
+import config
+import db
+import scheduler
+from ratelimit import request_limiter
+
+router = Router()
+router.chat_member.filter(F.chat.id == config.PRIVATE_GROUP_CHAT_ID)
+logger = logging.getLogger(__name__)
+
+
+# users.in_group отражает фактическое членство в закрытой группе: флаг ставится,
+# когда пользователь вошёл, и снимается, когда вышел или был удалён
+@router.chat_member(ChatMemberUpdatedFilter(JOIN_TRANSITION))
+async def on_member_joined(event: ChatMemberUpdated, bot: Bot):
+    user = event.new_chat_member.user
+    await db.set_user_in_group(user.id, True)
+    logger.info(f"Пользователь {user.username} (ID: {user.id}) вступил в закрытую группу",
+                extra={"sample": True, "tg_id": user.id})
+
+    if user.is_bot or event.new_chat_member.status != ChatMemberStatus.MEMBER:
+        return
+    end = await db.get_user_subscription_end(user.id)
+    if end is None:
+        return
+    if end < datetime.now():
+        # Вошёл по ранее выданной ссылке, когда подписка уже закончилась
+        await scheduler.kick_expired_user(bot, user.id, user.username, limiter=request_limiter)
+    else:
+        # Дедлайн участника — в шедулер, иначе до перезагрузки горизонта его там нет
+        db.notify_subscription_change(user.id, end)
+
+
+@router.chat_member(ChatMemberUpdatedFilter(LEAVE_TRANSITION))
+async def on_member_left(event: ChatMemberUpdated):
+    user = event.new_chat_member.user
+    await db.set_user_in_group(user.id, False)
+    logger.info(f"Пользователь {user.username} (ID: {user.id}) покинул закрытую группу",
+                extra={"sample": True, "tg_id": user.id})
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import logging
-import secrets
-from datetime import datetime, timedelta
 from aiogram import Router, F, Bot
 from aiogram.types import Message, PreCheckoutQuery
 
-import config
 import db
+import idempotency
+import invite_pool
+import outbox
+from admin_digest import admin_digest
 from handlers.shared import months
 from keyboards import menu_keyboard, support_keyboard
 
@@ -22,6 +23,43 @@ PAYMENT_NAMES = {
 }
 
 
+async def _notify_subscription(user_id: int, username: str, payment_name: str, new_end, in_group: bool,
+                               invite_link: str | None):
+    """Ставит в outbox уведомление об оплаченной подписке и добавляет платёж в дайджест админа."""
+    formatted_date = f"{new_end.day} {months[new_end.month - 1]} {new_end.year} года в {new_end.strftime('%H:%M')}"
+
+    if in_group:
+        await outbox.send_message(
+            user_id,
+            f"✅ Подписка продлена!\n\n📅 Новая дата окончания: {formatted_date}",
+            reply_markup=menu_keyboard
+        )
+    elif invite_link:
+        await outbox.send_message(
+            user_id,
+            f"✅ {payment_name} прошла успешно!\n\n"
+            f"🎉 Ваша ссылка для вступления в закрытую группу:\n{invite_link}\n\n"
+            f"📅 Подписка активна до: {formatted_date}",
+            reply_markup=menu_keyboard
+        )
+    else:
+        await outbox.send_message(
+            user_id,
+            "✅ Оплата прошла, но не удалось создать ссылку. Свяжитесь с Мастером.",
+            reply_markup=support_keyboard
+        )
+
+    if invite_link:
+        await admin_digest.add(
+            "payment",
+            f"💰 Новый платёж от @{username} (ID: {user_id})\n"
+            f"📦 {payment_name}\n"
+            f"📅 Подписка до: {formatted_date}\n"
+            f"🔗 Ссылка: {invite_link}",
+            tg_id=user_id, username=username,
+        )
+
+
 @router.pre_checkout_query()
 async def pre_checkout_handler(query: PreCheckoutQuery):
     await query.answer(ok=True)
@@ -37,51 +75,36 @@ async def successful_payment_handler(message: Message, bot: Bot):
     logger.info(f"✅ Успешная оплата от {username} ({user_id}) — {payment_name}")
 
     if payload in ["month_subscription", "year_subscription"]:
+        # Повторная доставка того же платежа не должна продлевать подписку второй раз
+        charge_key = idempotency.charge_key(message.successful_payment.telegram_payment_charge_id)
+        if await db.is_processed(charge_key):
+            logger.warning(f"Платёж {charge_key} от {user_id} уже учтён, пропускаю")
+            return
+
         days = 30 if payload == "month_subscription" else 365
-        in_group = db.is_user_in_group(user_id)
-        new_end = db.add_or_update_user(user_id, days=days, username=username, in_group=in_group)
-
-        formatted_date = f"{new_end.day} {months[new_end.month - 1]} {new_end.year} года в {new_end.strftime('%H:%M')}"
-
-        if not in_group:
-            try:
-                token = secrets.token_urlsafe(6)
-                invite = await bot.create_chat_invite_link(
-                    chat_id=config.PRIVATE_GROUP_CHAT_ID,
-                    name=f"invite_{user_id}_{token}",
-                    expire_date=int((datetime.utcnow() + timedelta(days=1)).timestamp()),
-                    member_limit=1,
-                )
-                invite_link = invite.invite_link
-                db.set_user_in_group(user_id, True)
-
-                await message.answer(
-                    f"✅ {payment_name} прошла успешно!\n\n"
-                    f"🎉 Ваша ссылка для вступления в закрытую группу:\n{invite_link}\n\n"
-                    f"📅 Подписка активна до: {formatted_date}",
-                    reply_markup=menu_keyboard
-                )
-
-                if config.ADMIN_ID:
-                    await bot.send_message(
-                        config.ADMIN_ID,
-                        f"💰 Новый платёж от @{username} (ID: {user_id})\n"
-                        f"📦 {payment_name}\n"
-                        f"📅 Подписка до: {formatted_date}\n"
-                        f"🔗 Ссылка: {invite_link}"
-                    )
-
-            except Exception as e:
-                await message.answer(
-                    "✅ Оплата прошла, но не удалось создать ссылку. Свяжитесь с Мастером.",
-                    reply_markup=support_keyboard
-                )
-                logger.error(f"Ошибка генерации ссылки для {user_id}: {e}")
-        else:
-            await message.answer(
-                f"✅ Подписка продлена!\n\n📅 Новая дата окончания: {formatted_date}",
-                reply_markup=menu_keyboard
-            )
+
+        async with db.transaction():
+            # Отметка платежа фиксируется вместе с продлением — одновременный дубль из
+            # другого воркера увидит её и ничего не изменит
+            if not await db.claim_processed(charge_key):
+                logger.warning(f"Платёж {charge_key} от {user_id} уже учтён, пропускаю")
+                return
+            new_end = await db.add_or_update_user(user_id, days=days, username=username)
+            in_group = await db.is_user_in_group(user_id)
+            # Ссылка из пула выдаётся в той же транзакции: при откате она вернётся в пул
+            invite_link = None if in_group else await invite_pool.claim(user_id)
+            if in_group or invite_link:
+                await _notify_subscription(user_id, username, payment_name, new_end, in_group, invite_link)
+        if in_group or invite_link:
+            return
+
+        # Пул пуст — ссылку создаём запросом к Telegram уже после фиксации платежа
+        try:
+            invite_link = await invite_pool.create(bot, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка генерации ссылки для {user_id}: {e}")
+        async with db.transaction():
+            await _notify_subscription(user_id, username, payment_name, new_end, False, invite_link)
 
     elif payload in ["consultation_payment", "amulet_payment"]:
         await message.answer(
@@ -89,9 +112,9 @@ async def successful_payment_handler(message: Message, bot: Bot):
             "📸 Пожалуйста, прикрепите чек об оплате для подтверждения.",
             reply_markup=menu_keyboard
         )
-        if config.ADMIN_ID:
-            await bot.send_message(
-                config.ADMIN_ID,
-                f"💰 Новый платёж: {payment_name}\n"
-                f"От @{username} (ID: {user_id})",
-            )
+        await admin_digest.add(
+            "payment",
+            f"💰 Новый платёж: {payment_name}\n"
+            f"От @{username} (ID: {user_id})",
+            tg_id=user_id, username=username,
+        )
@@ -0,0 +1,147 @@
+import logging
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+import callbacks
+import config
+import db
+import render
+from callbacks import ReviewBulk, ReviewPage, ReviewPick, ReviewPickPage
+from handlers.subscription import decide_payments
+from render import Screen
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# Консоль проверки чеков: /review показывает очередь awaiting_review страницами,
+# отмеченные заявки подтверждаются или отклоняются одним нажатием
+REVIEW_PAGE_SIZE = 10
+REVIEW_MAX_SELECTED = 100
+
+PLAN_TITLES = {
+    "subscription": "Подписка",
+    "consultation": "Консультация",
+    "amulet": "Амулет",
+}
+
+
+async def _selected(state: FSMContext) -> list[int]:
+    return (await state.get_data()).get("review_selected", [])
+
+
+async def _review_screen(after: int, selected: list[int], notice: str | None = None) -> Screen:
+    # Лишняя строка нужна только чтобы узнать, есть ли следующая страница
+    rows = await db.get_review_page(after, REVIEW_PAGE_SIZE + 1)
+    has_next = len(rows) > REVIEW_PAGE_SIZE
+    rows = rows[:REVIEW_PAGE_SIZE]
+    total = await db.count_review_queue()
+
+    lines = [notice, ""] if notice else []
+    lines += [f"🧾 Заявки на проверке: <b>{total}</b>", f"Выбрано: <b>{len(selected)}</b>", ""]
+    if not rows:
+        lines.append("Очередь пуста." if not after else "Дальше заявок нет.")
+    for row in rows:
+        lines.append(
+            f"#{row['id']} @{row['username'] or row['tg_id']} — {PLAN_TITLES.get(row['plan'], row['plan'])}, "
+            f"{row['amount'] / 100:.2f} руб. — {row['created_at']}"
+        )
+
+    keyboard = [
+        [InlineKeyboardButton(
+            text=f"{'☑️' if row['id'] in selected else '⬜️'} #{row['id']} · {row['amount'] / 100:.0f} руб.",
+            callback_data=ReviewPick(pid=row["id"], after=after).pack()
+        )]
+        for row in rows
+    ]
+    if rows:
+        keyboard.append([InlineKeyboardButton(text="☑️ Отметить страницу",
+                                              callback_data=ReviewPickPage(after=after).pack())])
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(text=f"✅ Подтвердить ({len(selected)})",
+                                 callback_data=ReviewBulk(approve=True, after=after).pack()),
+            InlineKeyboardButton(text=f"❌ Отклонить ({len(selected)})",
+                                 callback_data=ReviewBulk(approve=False, after=after).pack()),
+        ])
+    nav = [InlineKeyboardButton(text="🔄 Обновить", callback_data=ReviewPage(after=after).pack())]
+    if after:
+        nav.insert(0, InlineKeyboardButton(text="⏮ В начало", callback_data=ReviewPage(after=0).pack()))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Далее ▶️", callback_data=ReviewPage(after=rows[-1]["id"]).pack()))
+    keyboard.append(nav)
+
+    return Screen("\n".join(lines), InlineKeyboardMarkup(inline_keyboard=keyboard))
+
+
+@router.message(Command("review"))
+async def review_handler(message: Message, state: FSMContext):
+    if message.from_user.id != config.ADMIN_ID:
+        return await message.answer("❌ У вас нет прав для этой команды.")
+
+    await state.update_data(review_selected=[])
+    await render.send(message, await _review_screen(0, []))
+
+
+@callbacks.on(ReviewPage)
+async def review_page_handler(callback: CallbackQuery, callback_data: ReviewPage, state: FSMContext):
+    if callback.from_user.id != config.ADMIN_ID:
+        return await callback.answer("❌ У вас нет прав для этой команды.", show_alert=True)
+
+    await render.show(callback, await _review_screen(callback_data.after, await _selected(state)))
+
+
+@callbacks.on(ReviewPick)
+async def review_pick_handler(callback: CallbackQuery, callback_data: ReviewPick, state: FSMContext):
+    if callback.from_user.id != config.ADMIN_ID:
+        return await callback.answer("❌ У вас нет прав для этой команды.", show_alert=True)
+
+    selected = await _selected(state)
+    if callback_data.pid in selected:
+        selected.remove(callback_data.pid)
+    elif len(selected) >= REVIEW_MAX_SELECTED:
+        return await callback.answer(f"Можно отметить не больше {REVIEW_MAX_SELECTED} заявок.", show_alert=True)
+    else:
+        selected.append(callback_data.pid)
+    await state.update_data(review_selected=selected)
+    await render.show(callback, await _review_screen(callback_data.after, selected))
+
+
+@callbacks.on(ReviewPickPage)
+async def review_pick_page_handler(callback: CallbackQuery, callback_data: ReviewPickPage, state: FSMContext):
+    if callback.from_user.id != config.ADMIN_ID:
+        return await callback.answer("❌ У вас нет прав для этой команды.", show_alert=True)
+
+    selected = await _selected(state)
+    page = [row["id"] for row in await db.get_review_page(callback_data.after, REVIEW_PAGE_SIZE)]
+    selected += [pid for pid in page if pid not in selected][:REVIEW_MAX_SELECTED - len(selected)]
+    await state.update_data(review_selected=selected)
+    await render.show(callback, await _review_screen(callback_data.after, selected))
+
+
+@callbacks.on(ReviewBulk)
+async def review_bulk_handler(callback: CallbackQuery, callback_data: ReviewBulk, state: FSMContext):
+    if callback.from_user.id != config.ADMIN_ID:
+        return await callback.answer("❌ У вас нет прав для этой команды.", show_alert=True)
+
+    selected = await _selected(state)
+    if not selected:
+        return await callback.answer("Ничего не выбрано.", show_alert=True)
+
+    # Отвечаем сразу: если пул ссылок кончился, решение займёт время запросов к Telegram
+    await callback.answer("⏳ Обрабатываю…")
+
+    approved = callback_data.approve
+    payments = [p for p in await db.get_pendings_by_ids(selected) if p["status"] in db.OPEN_PAYMENT_STATUSES]
+    # Итог админ видит на экране консоли; отдельное сообщение на каждую ссылку не нужно
+    decided = await decide_payments(callback.bot, payments, approved, callback.from_user.id, notify_admin=False)
+    await state.update_data(review_selected=[])
+
+    skipped = len(selected) - len(decided)
+    text = f"{'✅ Подтверждено' if approved else '❌ Отклонено'}: {len(decided)}"
+    if skipped:
+        text += f", уже обработаны: {skipped}"
+    logger.info("Admin %s: %s", callback.from_user.id, text)
+    await render.edit_or_send(callback.message, await _review_screen(callback_data.after, [], text))
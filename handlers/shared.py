@@ -75,7 +75,6 @@ subscription_text = (
     "Информация уникальна и не публикуется в открытых источниках."
 )
 
-last_click = {}
 months = [
     'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
     'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря'
@@ -1,21 +1,24 @@
 from aiogram import Router
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InputMediaPhoto
+from aiogram.types import Message, CallbackQuery
 
+import callbacks
+import render
+from callbacks import MainMenu
 from keyboards import main_menu
-from .shared import PHOTOS, main_text
+from render import Screen
+from .shared import main_text
 
 router = Router()
 
+MAIN_SCREEN = Screen(main_text, main_menu)
+
 
 @router.message(Command("start"))
 async def start_handler(message: Message):
-    await message.answer(
-        text=main_text,
-        reply_markup=main_menu
-    )
+    await render.send(message, MAIN_SCREEN)
 
 
-@router.callback_query(lambda c: c.data == "back_main")
+@callbacks.on(MainMenu)
 async def back_main_handler(callback: CallbackQuery):
-    await callback.message.edit_text(text=main_text, reply_markup=main_menu)
+    await render.show(callback, MAIN_SCREEN)
@@ -0,0 +1,7 @@
+from aiogram.fsm.state import State, StatesGroup
+
+
+class PaymentStates(StatesGroup):
+    """Оплата по реквизитам: чек → контактные данные."""
+    waiting_receipt = State()
+    waiting_contacts = State()
@@ -1,100 +1,70 @@
 from __future__ import annotations
 
 import re
-from datetime import datetime, timedelta
 
 import logging
-import secrets
 
-from aiogram import Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, Message
-from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.methods import SendDocument, SendMessage, SendPhoto
 
+import callbacks
 import db
 import config
+import invite_pool
+import outbox
+import render
+from ratelimit import run_pool
 from handlers.shared import offer_text, months, consultation_text, amulet_text, subscription_text
-from keyboards import main_menu, subscription_menu, support_keyboard, menu_keyboard, consultation_menu, amulet_menu
+from callbacks import (
+    AcceptOffer, AttachReceipt, CreatePending, Decision, MainMenu, Offer, PaymentProcessed, Service,
+)
+from handlers.states import PaymentStates
+from render import Screen
+from keyboards import subscription_menu, support_keyboard, menu_keyboard, consultation_menu, amulet_menu
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
-async def safe_edit_or_send(callback: CallbackQuery, text: str, reply_markup):
-    """Попробовать edit_text, иначе отправить новое сообщение."""
-    if callback.message and callback.message.text:
-        try:
-            await callback.message.edit_text(text=text, reply_markup=reply_markup)
-        except Exception:
-            await callback.message.answer(text=text, reply_markup=reply_markup)
-    else:
-        await callback.message.answer(text=text, reply_markup=reply_markup)
-    await callback.answer()
-
-
 # === Этап 1. Переход к публичной оферте ===
-@router.callback_query(F.data == "buy_subscription")
-async def buy_subscription_offer(callback: CallbackQuery):
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Согласен", callback_data="accept_offer:subscription")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_main")]
-    ])
-    await safe_edit_or_send(callback, offer_text, kb)
+# Экраны собираются один раз при импорте, а не на каждое нажатие
+OFFER_SCREENS = {
+    service: Screen(offer_text, InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Согласен", callback_data=AcceptOffer(service=service).pack())],
+        [InlineKeyboardButton(text="↩️ Назад", callback_data=MainMenu().pack())]
+    ]))
+    for service in Service
+}
 
 
-@router.callback_query(F.data == "buy_consultation")
-async def buy_consultation_offer(callback: CallbackQuery):
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Согласен", callback_data="accept_offer:consultation")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_main")]
-    ])
-    await safe_edit_or_send(callback, offer_text, kb)
-
-
-@router.callback_query(F.data == "buy_amulet")
-async def buy_amulet_offer(callback: CallbackQuery):
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Согласен", callback_data="accept_offer:amulet")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_main")]
-    ])
-    await safe_edit_or_send(callback, offer_text, kb)
+@callbacks.on(Offer)
+async def show_offer(callback: CallbackQuery, callback_data: Offer):
+    await render.show(callback, OFFER_SCREENS[callback_data.service])
 
 
 # === Этап 2. После согласия с офертой ===
-@router.callback_query(F.data.startswith("accept_offer"))
-async def accept_offer(callback: CallbackQuery):
-    try:
-        _, service = callback.data.split(":", 1)
-    except ValueError:
-        service = "subscription"
-
-    if service == "subscription":
-        await callback.message.edit_text(text=subscription_text, reply_markup=subscription_menu)
-        await callback.answer()
-        return
+SERVICE_SCREENS = {
+    Service.subscription: Screen(subscription_text, subscription_menu),
+    Service.consultation: Screen(consultation_text, consultation_menu),
+    Service.amulet: Screen(amulet_text, amulet_menu),
+}
 
-    if service == "consultation":
-        await callback.message.edit_text(text=consultation_text, reply_markup=consultation_menu)
-        await callback.answer()
-        return
 
-    if service == "amulet":
-        await callback.message.edit_text(text=amulet_text, reply_markup=amulet_menu)
-        await callback.answer()
-        return
+@callbacks.on(AcceptOffer)
+async def accept_offer(callback: CallbackQuery, callback_data: AcceptOffer):
+    await render.show(callback, SERVICE_SCREENS[callback_data.service])
 
 
 # === Этап 3. Создание заявки (pending) ===
-@router.callback_query(F.data.startswith("create_pending:"))
-async def create_pending_handler(callback: CallbackQuery):
-    try:
-        _, plan, amount_s = callback.data.split(":", 2)
-        amount = int(amount_s)
-    except Exception:
-        await callback.answer("Ошибка формирования заявки.", show_alert=True)
-        return
+@callbacks.on(CreatePending)
+async def create_pending_handler(callback: CallbackQuery, callback_data: CreatePending):
+    plan = callback_data.service.name
+    amount = callback_data.amount
 
     user = callback.from_user
-    pid = db.create_pending_payment(user.id, user.username or user.first_name, plan, amount)
+    pid = await db.create_pending_payment(user.id, user.username or user.first_name, plan, amount)
     logger.info("Created pending payment %s for user %s plan=%s amount=%s", pid, user.id, plan, amount)
 
     plan_text = (
@@ -117,61 +87,44 @@ async def create_pending_handler(callback: CallbackQuery):
     )
 
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📎 Прикрепить чек", callback_data=f"attach_receipt:{pid}")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_offer")]
+        [InlineKeyboardButton(text="📎 Прикрепить чек", callback_data=AttachReceipt(pid=pid).pack())],
+        [InlineKeyboardButton(text="↩️ Назад", callback_data=Offer(service=callback_data.service).pack())]
     ])
 
-    try:
-        await callback.message.edit_text(text=text, reply_markup=kb)
-    except Exception:
-        await callback.message.answer(text=text, reply_markup=kb)
-
-    await callback.answer("Заявка создана — прикрепите чек.")
+    await render.show(callback, Screen(text, kb), "Заявка создана — прикрепите чек.")
 
 
 # === Этап 4. Прикрепление чека ===
-@router.callback_query(F.data.startswith("attach_receipt:"))
-async def attach_receipt_prompt(callback: CallbackQuery):
-    try:
-        _, pid = callback.data.split(":", 1)
-    except Exception:
-        await callback.answer("Ошибка ID заявки.")
-        return
+RECEIPT_PROMPT_SCREEN = Screen(
+    "📎 Пожалуйста, отправьте фото или документ с чеком.\n\n"
+    "❗ Только изображение или файл — текстовые сообщения не принимаются."
+)
 
-    db.set_receipt_waiting(callback.from_user.id, pid)
 
-    try:
-        await callback.message.edit_text(
-            "📎 Пожалуйста, отправьте фото или документ с чеком.\n\n"
-            "❗ Только изображение или файл — текстовые сообщения не принимаются."
-        )
-    except Exception:
-        await callback.message.answer(
-            "📎 Пожалуйста, отправьте фото или документ с чеком.\n\n"
-            "❗ Только изображение или файл — текстовые сообщения не принимаются."
-        )
+@callbacks.on(AttachReceipt)
+async def attach_receipt_prompt(callback: CallbackQuery, callback_data: AttachReceipt, state: FSMContext):
+    pid = callback_data.pid
+    await state.set_state(PaymentStates.waiting_receipt)
+    await state.set_data({"pid": pid})
 
-    await callback.answer()
+    await render.show(callback, RECEIPT_PROMPT_SCREEN)
 
 
 # === Этап 5. Приём фото или документа от пользователя ===
-@router.message(F.photo | F.document)
-async def handle_receipt_upload(message: Message):
-    user_id = message.from_user.id
-    pending = db.get_receipt_waiting(user_id)
-    if not pending:
-        return
-
+@router.message(PaymentStates.waiting_receipt, F.photo | F.document)
+async def handle_receipt_upload(message: Message, state: FSMContext):
+    pending = await state.get_data()
     pid = pending["pid"]
-    plan = pending["plan"]
 
     file_id = message.photo[-1].file_id if message.photo else message.document.file_id
 
-    db.save_receipt_file(pid, file_id)
-    db.set_receipt_waiting(user_id, None)
+    if not await db.save_receipt_file(pid, file_id):
+        await state.clear()
+        await message.answer("Эта заявка уже обработана.", reply_markup=menu_keyboard)
+        return
 
     # Переходим к сбору контактных данных
-    db.set_contacts_waiting(user_id, pid)
+    await state.set_state(PaymentStates.waiting_contacts)
 
     await message.answer(
         "✅ Чек получен! Теперь укажите ваши контактные данные:\n\n"
@@ -182,15 +135,56 @@ async def handle_receipt_upload(message: Message):
     )
 
 
-# === Этап 6. Сбор контактных данных ===
-@router.message(F.text)
-async def handle_contacts(message: Message):
-    user_id = message.from_user.id
-    pending = db.get_contacts_waiting(user_id)
+async def _notify_admin_new_payment(pid: int, pending_data: dict, user_id: int, phone: str, email: str):
+    """Ставит в очередь заявку на проверку для админа: чек с подписью и кнопками решения."""
+    plan = pending_data["plan"]
+    amount = pending_data["amount"] / 100
+    username = pending_data.get("username") or str(user_id)
+    plan_text = (
+        "Консультация" if plan == "consultation"
+        else "Амулет" if plan == "amulet"
+        else "Подписка"
+    )
 
-    if not pending:
-        return  # Игнорируем текстовые сообщения не в состоянии ожидания контактов
+    admin_text = (
+        f"🆕 Новая заявка на оплату #{pid}\n\n"
+        f"👤 Пользователь: @{username} (ID: {user_id})\n"
+        f"📦 Услуга: <b>{plan_text}</b>\n"
+        f"💰 Сумма: <b>{amount:.2f}</b> руб.\n"
+        f"📱 Телефон: <b>{phone}</b>\n"
+        f"📧 Email: <b>{email}</b>\n\n"
+        f"Для подтверждения используйте кнопки ниже:"
+    )
+
+    kb_admin = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ Подтвердить", callback_data=Decision(pid=pid, approve=True).pack()),
+            InlineKeyboardButton(text="❌ Отклонить", callback_data=Decision(pid=pid, approve=False).pack())
+        ],
+        [InlineKeyboardButton(text="💬 Перейти к пользователю", url=f"tg://user?id={user_id}")]
+    ])
+
+    proof_file_id = pending_data.get("proof_file_id")
+    if not proof_file_id:
+        await outbox.send_message(config.ADMIN_ID, admin_text, reply_markup=kb_admin)
+        return
 
+    # Отправляем чек админу; если Telegram его не примет — только текст заявки
+    if proof_file_id.startswith("AgAC"):  # фото
+        method = SendPhoto(chat_id=config.ADMIN_ID, photo=proof_file_id, caption=admin_text, reply_markup=kb_admin)
+    else:  # документ
+        method = SendDocument(chat_id=config.ADMIN_ID, document=proof_file_id, caption=admin_text, reply_markup=kb_admin)
+    await outbox.enqueue(
+        method,
+        fallback=SendMessage(chat_id=config.ADMIN_ID, text=admin_text + "\n\n❌ Чек не загружен", reply_markup=kb_admin),
+    )
+
+
+# === Этап 6. Сбор контактных данных ===
+@router.message(PaymentStates.waiting_contacts, F.text)
+async def handle_contacts(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    pending = await state.get_data()
     pid = pending["pid"]
     text = message.text.strip()
 
@@ -228,72 +222,15 @@ async def handle_contacts(message: Message):
         )
         return
 
-    # Сохраняем контактные данные
-    db.update_payment_contacts(pid, phone, email)
+    # Контакты и уведомление админа сохраняются одной транзакцией
+    async with db.transaction():
+        await db.update_payment_contacts(pid, phone, email)
+        pending_data = await db.get_payment(pid)
+        if pending_data and config.ADMIN_ID:
+            await _notify_admin_new_payment(pid, pending_data, user_id, phone, email)
 
     # Сбрасываем состояние ожидания
-    db.clear_user_state(user_id)
-
-    # Уведомляем админа
-    pending_data = db.get_payment(pid)
-    if pending_data and config.ADMIN_ID:
-        plan = pending_data["plan"]
-        amount = pending_data["amount"] / 100
-        username = pending_data.get("username") or str(user_id)
-        plan_text = (
-            "Консультация" if plan == "consultation"
-            else "Амулет" if plan == "amulet"
-            else "Подписка"
-        )
-
-        admin_text = (
-            f"🆕 Новая заявка на оплату #{pid}\n\n"
-            f"👤 Пользователь: @{username} (ID: {user_id})\n"
-            f"📦 Услуга: <b>{plan_text}</b>\n"
-            f"💰 Сумма: <b>{amount:.2f}</b> руб.\n"
-            f"📱 Телефон: <b>{phone}</b>\n"
-            f"📧 Email: <b>{email}</b>\n\n"
-            f"Для подтверждения используйте кнопки ниже:"
-        )
-
-        kb_admin = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="✅ Подтвердить", callback_data=f"approve:{pid}"),
-                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject:{pid}")
-            ],
-            [InlineKeyboardButton(text="💬 Перейти к пользователю", url=f"tg://user?id={user_id}")]
-        ])
-
-        # Отправляем чек админу, если есть
-        if pending_data.get("proof_file_id"):
-            try:
-                if pending_data["proof_file_id"].startswith("AgAC"):  # фото
-                    await message.bot.send_photo(
-                        chat_id=config.ADMIN_ID,
-                        photo=pending_data["proof_file_id"],
-                        caption=admin_text,
-                        reply_markup=kb_admin
-                    )
-                else:  # документ
-                    await message.bot.send_document(
-                        chat_id=config.ADMIN_ID,
-                        document=pending_data["proof_file_id"],
-                        caption=admin_text,
-                        reply_markup=kb_admin
-                    )
-            except Exception as e:
-                logger.error(f"Ошибка отправки чека админу: {e}")
-                await message.bot.send_message(
-                    chat_id=config.ADMIN_ID,
-                    text=admin_text + f"\n\n❌ Чек не загружен: {e}",
-                    reply_markup=kb_admin
-                )
-        else:
-            await message.bot.send_message(
-                chat_id=config.ADMIN_ID,
-                text=admin_text,
-                reply_markup=kb_admin
-            )
+    await state.clear()
 
     await message.answer(
         "✅ Спасибо! Ваши контактные данные получены.\n\n"
@@ -304,22 +241,170 @@ async def handle_contacts(message: Message):
 
 
 # === Этап 7. Подтверждение или отклонение (для администратора) ===
-@router.callback_query(F.data.startswith("approve:") | F.data.startswith("reject:"))
-async def handle_admin_decision(callback: CallbackQuery):
-    try:
-        action, pid = callback.data.split(":", 1)
-    except ValueError:
-        await callback.answer("Ошибка ID.", show_alert=True)
-        return
+DAYS_BY_AMOUNT = {
+    50000: 30,
+    120000: 90,
+    220000: 180,
+    400000: 365
+}
+
+
+# Сколько ссылок создаётся параллельно, если пул кончился посреди пачки
+DIRECT_INVITE_CONCURRENCY = 5
+
+
+async def _claim_invites(payments: list[dict]) -> tuple[set[int], dict[int, str]]:
+    """Кто из покупателей подписки уже в группе и ссылки из пула для остальных — по одной на пользователя.
+
+    Вызывается внутри транзакции только для заявок, прошедших compare-and-set:
+    при откате выданные ссылки вернутся в пул. Пул пополняет ведущий процесс
+    (invite_pool.run_refiller); кому ссылки не хватило, в links не попадёт.
+    """
+    uids = list({p["tg_id"] for p in payments if p["plan"] == "subscription"})
+    in_group = await db.get_users_in_group(uids)
+    links: dict[int, str] = {}
+    for uid in uids:
+        if uid not in in_group and (link := await invite_pool.claim(uid)):
+            links[uid] = link
+    return in_group, links
+
+
+def _subscription_messages(uid: int, username: str, new_end, in_group: bool, invite_link: str | None,
+                           notify_admin: bool) -> list[SendMessage]:
+    formatted_date = f"{new_end.day} {months[new_end.month - 1]} {new_end.year} года в {new_end.strftime('%H:%M')}"
+
+    if in_group:
+        return [SendMessage(
+            chat_id=uid,
+            text=f"✅ Подписка продлена!\n\n📅 Новая дата окончания: {formatted_date}",
+            reply_markup=menu_keyboard
+        )]
+
+    if not invite_link:
+        return [SendMessage(
+            chat_id=uid,
+            text="✅ Оплата подтверждена, но не удалось создать ссылку. Свяжитесь с Мастером.",
+            reply_markup=support_keyboard
+        )]
+
+    messages = [SendMessage(
+        chat_id=uid,
+        text=f"✅ Подписка активирована!\n\n"
+             f"🎉 Ваша ссылка для вступления в закрытую группу:\n{invite_link}\n\n"
+             f"📅 Подписка активна до: {formatted_date}"
+    )]
+    if notify_admin and config.ADMIN_ID:
+        messages.append(SendMessage(
+            chat_id=config.ADMIN_ID,
+            text=f"💰 Подтверждён платёж от @{username} (ID: {uid})\n"
+                 f"📦 Подписка\n"
+                 f"📅 До: {formatted_date}\n"
+                 f"🔗 Ссылка: {invite_link}"
+        ))
+    return messages
+
+
+async def _decision_messages(payment: dict, approved: bool, in_group: set[int], links: dict[int, str],
+                             notify_admin: bool) -> list[SendMessage]:
+    """Применяет решение по одной заявке (продлевает подписку) и возвращает уведомления."""
+    uid = payment["tg_id"]
+    username = payment.get("username") or str(uid)
+    plan = payment["plan"]
+
+    if not approved:
+        return [SendMessage(
+            chat_id=uid,
+            text="❌ Ваш платёж не подтверждён.\nПожалуйста, свяжитесь с Мастером.",
+            reply_markup=support_keyboard
+        )]
+
+    if plan in ["consultation", "amulet"]:
+        return [SendMessage(
+            chat_id=uid,
+            text="✨ Ваш платёж подтверждён. Спасибо!\n"
+                 "Мастер свяжется с вами в ближайшее время.",
+        )]
+    if plan != "subscription":
+        return []
+
+    new_end = await db.add_or_update_user(uid, days=DAYS_BY_AMOUNT.get(payment["amount"], 30), username=username)
+    if uid not in in_group and uid not in links:
+        # Пул пуст: ссылку создаст запросом к Telegram decide_payments уже после коммита
+        return []
+    return _subscription_messages(uid, username, new_end, uid in in_group, links.get(uid), notify_admin)
+
+
+async def _send_direct_invites(bot: Bot, payments: list[dict], notify_admin: bool):
+    """Создаёт ссылки напрямую для тех, кому не хватило пула, и ставит уведомления в outbox."""
+    links: dict[int, str] = {}
+
+    async def _create(uid: int):
+        links[uid] = await invite_pool.create(bot, uid)
+
+    await run_pool({p["tg_id"] for p in payments}, _create, DIRECT_INVITE_CONCURRENCY)
+
+    async with db.transaction():
+        messages = []
+        for payment in payments:
+            uid = payment["tg_id"]
+            messages += _subscription_messages(
+                uid, payment.get("username") or str(uid), await db.get_user_subscription_end(uid),
+                False, links.get(uid), notify_admin,
+            )
+        await outbox.enqueue_many(messages)
+
+
+async def decide_payments(bot: Bot, payments: list[dict], approved: bool, admin_id: int,
+                          notify_admin: bool = True) -> list[dict]:
+    """Подтверждает или отклоняет заявки; возвращает те, что обработаны этим вызовом.
+
+    Статусы, подписки и уведомления фиксируются одной транзакцией, а рассылает
+    уведомления outbox уже после коммита. Статусы меняются compare-and-set, так что
+    при двойном нажатии или гонке воркеров каждую заявку обработает только один.
+    Ссылки берутся из пула; если его не хватило, недостающие создаются запросами
+    к Telegram после коммита, поэтому админу стоит ответить на callback заранее.
+    """
+    async with db.transaction():
+        decided = await db.set_pending_statuses(
+            [p["id"] for p in payments], "approved" if approved else "rejected", admin_id
+        )
+        in_group, links = await _claim_invites(decided) if approved else (set(), {})
+        messages = []
+        for payment in decided:
+            messages += await _decision_messages(payment, approved, in_group, links, notify_admin)
+        if messages:
+            await outbox.enqueue_many(messages)
+
+    for payment in decided:
+        logger.info("Payment %s %s by admin", payment["id"], "approve" if approved else "reject")
+
+    # Запросы к Telegram — только после коммита и только если пула не хватило
+    unlinked = [p for p in decided if approved and p["plan"] == "subscription"
+                and p["tg_id"] not in in_group and p["tg_id"] not in links]
+    if unlinked:
+        await _send_direct_invites(bot, unlinked, notify_admin)
+    return decided
+
+
+@callbacks.on(Decision)
+async def handle_admin_decision(callback: CallbackQuery, callback_data: Decision):
+    pid = callback_data.pid
 
     # Проверяем текущий статус платежа
-    pending = db.get_payment(pid)
-    if pending and pending["status"] in ["approved", "rejected"]:
+    pending = await db.get_payment(pid)
+    if not pending:
+        await callback.answer("Платёж не найден.", show_alert=True)
+        return
+    if pending["status"] not in db.OPEN_PAYMENT_STATUSES:
         await callback.answer("Этот платёж уже обработан.", show_alert=True)
         return
 
-    approved = action == "approve"
-    db.set_payment_status(pid, "approved" if approved else "rejected")
+    approved = callback_data.approve
+    uid = pending["tg_id"]
+
+    if not await decide_payments(callback.bot, [pending], approved, callback.from_user.id):
+        await callback.answer("Этот платёж уже обработан.", show_alert=True)
+        return
 
     text = (
         "✅ Оплата подтверждена. Пользователь уведомлён." if approved
@@ -331,13 +416,13 @@ async def handle_admin_decision(callback: CallbackQuery):
         [
             InlineKeyboardButton(
                 text="✅ Подтверждён",
-                callback_data="already_processed"
+                callback_data=PaymentProcessed().pack()
             ) if approved else InlineKeyboardButton(
                 text="❌ Отклонён",
-                callback_data="already_processed"
+                callback_data=PaymentProcessed().pack()
             )
         ],
-        [InlineKeyboardButton(text="💬 Перейти к пользователю", url=f"tg://user?id={pending['tg_id']}")]
+        [InlineKeyboardButton(text="💬 Перейти к пользователю", url=f"tg://user?id={uid}")]
     ])
 
     # Обновляем сообщение с заблокированными кнопками
@@ -346,106 +431,10 @@ async def handle_admin_decision(callback: CallbackQuery):
         reply_markup=new_keyboard
     )
 
-    # Остальной код обработки уведомлений пользователя...
-    if pending:
-        uid = pending["tg_id"]
-        username = pending.get("username") or str(uid)
-        plan = pending["plan"]
-        amount = pending["amount"]
-        days_map = {
-            50000: 30,
-            120000: 90,
-            220000: 180,
-            400000: 365
-        }
-        days = days_map.get(amount, 30)
-
-        if approved:
-            if plan == "subscription":
-                in_group = db.is_user_in_group(uid)
-                new_end = db.add_or_update_user(uid, days=days, username=username, in_group=in_group)
-
-                formatted_date = f"{new_end.day} {months[new_end.month - 1]} {new_end.year} года в {new_end.strftime('%H:%M')}"
-
-                if not in_group:
-                    try:
-                        token = secrets.token_urlsafe(6)
-                        invite = await callback.bot.create_chat_invite_link(
-                            chat_id=config.PRIVATE_GROUP_CHAT_ID,
-                            name=f"invite_{uid}_{token}",
-                            expire_date=int((datetime.utcnow() + timedelta(days=1)).timestamp()),
-                            member_limit=1,
-                        )
-                        invite_link = invite.invite_link
-                        db.set_user_in_group(uid, True)
-
-                        await callback.bot.send_message(
-                            uid,
-                            f"✅ Подписка активирована!\n\n"
-                            f"🎉 Ваша ссылка для вступления в закрытую группу:\n{invite_link}\n\n"
-                            f"📅 Подписка активна до: {formatted_date}"
-                        )
-
-                        if config.ADMIN_ID:
-                            await callback.bot.send_message(
-                                config.ADMIN_ID,
-                                f"💰 Подтверждён платёж от @{username} (ID: {uid})\n"
-                                f"📦 Подписка\n"
-                                f"📅 До: {formatted_date}\n"
-                                f"🔗 Ссылка: {invite_link}"
-                            )
-
-                    except Exception as e:
-                        await callback.bot.send_message(
-                            uid,
-                            "✅ Оплата подтверждена, но не удалось создать ссылку. Свяжитесь с Мастером.",
-                            reply_markup=support_keyboard
-                        )
-                        logger.error(f"Ошибка генерации ссылки для {uid}: {e}")
-                else:
-                    await callback.bot.send_message(
-                        uid,
-                        f"✅ Подписка продлена!\n\n📅 Новая дата окончания: {formatted_date}",
-                        reply_markup=menu_keyboard
-                    )
-
-            elif plan in ["consultation", "amulet"]:
-                await callback.bot.send_message(
-                    uid,
-                    "✨ Ваш платёж подтверждён. Спасибо!\n"
-                    "Мастер свяжется с вами в ближайшее время.",
-                )
-        else:
-            await callback.bot.send_message(
-                uid,
-                "❌ Ваш платёж не подтверждён.\nПожалуйста, свяжитесь с Мастером.",
-                reply_markup=support_keyboard
-            )
-
     await callback.answer(text)
-    logger.info("Payment %s %s by admin", pid, action)
 
 
 # Обработчик для заблокированных кнопок
-@router.callback_query(F.data == "already_processed")
+@callbacks.on(PaymentProcessed)
 async def handle_already_processed(callback: CallbackQuery):
     await callback.answer("Этот платёж уже обработан.", show_alert=True)
-
-
-# === Кнопки "назад" ===
-@router.callback_query(F.data == "back_offer")
-async def back_offer(callback: CallbackQuery):
-    await safe_edit_or_send(callback, offer_text, InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Согласен", callback_data="accept_offer:subscription")],
-        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_main")]
-    ]))
-
-
-@router.callback_query(F.data == "back_main")
-@router.message(Command("start"))
-async def back_main(callback_or_message):
-    text = "🌟 Добро пожаловать! Главное меню:"
-    if isinstance(callback_or_message, CallbackQuery):
-        await safe_edit_or_send(callback_or_message, text, main_menu)
-    else:
-        await callback_or_message.answer(text, reply_markup=main_menu)
@@ -0,0 +1,69 @@
+# idempotency.py
+"""Защита от повторной обработки апдейтов Telegram.
+
+Telegram доставляет апдейт повторно, если не получил подтверждения (таймаут
+вебхука, перезапуск), а при нескольких воркерах повтор может попасть в другой
+процесс. UpdateDedupMiddleware отмечает update_id в таблице processed_updates
+одним INSERT ... ON CONFLICT DO NOTHING до вызова хендлеров: апдейт, который
+уже отмечен, пропускается. Если хендлер упал, отметка снимается, и повторная
+доставка обработает апдейт заново.
+
+Платежи дополнительно отмечаются по telegram_payment_charge_id в транзакции
+продления подписки (handlers/payment.py). Отметки старше PROCESSED_TTL
+удаляет run_pruner — Telegram не повторяет апдейты дольше суток.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import db
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_TTL = 7 * 24 * 60 * 60
+
+
+def update_key(update_id: int) -> str:
+    return f"update:{update_id}"
+
+
+def charge_key(charge_id: str) -> str:
+    return f"charge:{charge_id}"
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: каждый update_id обрабатывается один раз."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        key = update_key(event.update_id)
+        if not await db.claim_processed(key):
+            logger.info("Апдейт %s уже обработан, пропускаю", event.update_id)
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            await db.release_processed(key)
+            raise
+
+
+def setup(dp):
+    dp.update.outer_middleware(UpdateDedupMiddleware())
+
+
+async def run_pruner(interval: int = 60 * 60):
+    """Периодически удаляет старые отметки обработанных событий."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await db.prune_processed(int(time.time()) - PROCESSED_TTL)
+        except Exception as e:
+            logger.error(f"Ошибка очистки processed_updates: {e}")
@@ -1,5 +1,19 @@
+import asyncio
+
 import db
+import migrations
+
+
+async def main():
+    applied = await db.init_db()
+    await db.close()
+    names = dict((version, name) for version, name, _ in migrations.MIGRATIONS)
+    for version in applied:
+        print(f"  применена миграция {version}_{names[version]}")
+    if not applied:
+        print("  схема актуальна, новых миграций нет")
+
 
 if __name__ == "__main__":
-    db.init_db()
-    print("✅ База данных успешно инициализирована")
\ No newline at end of file
+    asyncio.run(main())
+    print("✅ База данных успешно инициализирована")
@@ -0,0 +1,105 @@
+# invite_pool.py
+"""Пул заранее созданных одноразовых ссылок-приглашений в закрытую группу.
+
+Ссылки создаются фоном (в ведущем процессе) и хранятся в таблице invite_links,
+поэтому при подтверждении оплаты пользователь получает ссылку без запроса к
+Telegram. Ссылки, которым осталось жить меньше INVITE_MIN_TTL, отзываются и
+заменяются новыми. Если пул пуст, ссылка создаётся как раньше — напрямую.
+"""
+import asyncio
+import logging
+import secrets
+import time
+
+from aiogram import Bot
+
+import config
+import db
+from ratelimit import TelegramRateLimiter, call_with_retry, request_limiter, telegram_limiter
+
+logger = logging.getLogger(__name__)
+
+# Сколько действует ссылка из пула и сколько минимум должно остаться при выдаче
+INVITE_LINK_TTL = 7 * 24 * 60 * 60
+INVITE_MIN_TTL = 24 * 60 * 60
+REFILL_INTERVAL = 60
+
+_low = asyncio.Event()
+
+
+async def _create_link(bot: Bot, name: str, ttl: int,
+                       limiter: TelegramRateLimiter = telegram_limiter) -> tuple[str, int]:
+    expire_at = int(time.time()) + ttl
+    invite = await call_with_retry(
+        None, bot.create_chat_invite_link,
+        chat_id=config.PRIVATE_GROUP_CHAT_ID,
+        name=name,
+        expire_date=expire_at,
+        member_limit=1,
+        limiter=limiter,
+    )
+    return invite.invite_link, expire_at
+
+
+async def create(bot: Bot, tg_id: int) -> str:
+    """Создаёт ссылку для пользователя запросом к Telegram, когда в пуле ничего не нашлось.
+
+    Вызывается вне транзакции: запрос к Telegram не должен её удерживать.
+    """
+    logger.warning("Пул ссылок пуст, создаём ссылку для %s напрямую", tg_id)
+    _low.set()
+    link, expire_at = await _create_link(bot, f"invite_{tg_id}_{secrets.token_urlsafe(6)}", INVITE_MIN_TTL,
+                                         request_limiter)
+    await db.save_invite_link(tg_id, link, expire_at)
+    return link
+
+
+async def claim(tg_id: int) -> str | None:
+    """Выдаёт ссылку только из пула, без запросов к Telegram, — можно вызывать внутри транзакции.
+
+    При откате транзакции ссылка возвращается в пул вместе с ней.
+    """
+    link = await db.claim_invite_link(tg_id, int(time.time()) + INVITE_MIN_TTL)
+    if link:
+        db.after_commit(_low.set)
+    return link
+
+
+async def refill(bot: Bot):
+    """Отзывает устаревающие свободные ссылки и дополняет пул до INVITE_POOL_SIZE."""
+    min_expire_at = int(time.time()) + INVITE_MIN_TTL
+
+    for link in await db.take_stale_invite_links(min_expire_at):
+        try:
+            await call_with_retry(None, bot.revoke_chat_invite_link, config.PRIVATE_GROUP_CHAT_ID, link)
+        except Exception as e:
+            logger.warning(f"Не удалось отозвать ссылку {link}: {e}")
+
+    missing = config.INVITE_POOL_SIZE - await db.count_free_invite_links(min_expire_at)
+    if missing <= 0:
+        return
+
+    links = []
+    for _ in range(missing):
+        try:
+            links.append(await _create_link(bot, f"pool_{secrets.token_urlsafe(6)}", INVITE_LINK_TTL))
+        except Exception as e:
+            logger.error(f"Не удалось создать ссылку для пула: {e}")
+            break
+    if links:
+        await db.add_pool_invite_links(links)
+        logger.info("Пул ссылок пополнен на %s", len(links))
+
+
+async def run_refiller(bot: Bot):
+    """Пополняет пул раз в REFILL_INTERVAL секунд или сразу после выдачи ссылки."""
+    while True:
+        try:
+            await refill(bot)
+        except Exception as e:
+            logger.error(f"Ошибка пополнения пула ссылок: {e}")
+        _low.clear()
+        try:
+            await asyncio.wait_for(_low.wait(), timeout=REFILL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
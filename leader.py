@@ -0,0 +1,73 @@
+# leader.py
+"""Выбор ведущего процесса через lease в БД.
+
+Фоновые задачи (проверка подписок и т.п.) должны выполняться ровно в одном
+из запущенных процессов бота. Процесс, захвативший lease, запускает задачу и
+продлевает аренду каждые `renew_every` секунд; если продлить не удалось,
+задача останавливается, и её подхватывает другой процесс после истечения TTL.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import suppress
+from typing import Awaitable, Callable
+
+import db
+
+logger = logging.getLogger(__name__)
+
+_worker_id: tuple[int, str] | None = None
+
+
+def worker_id() -> str:
+    """Идентификатор текущего процесса для lease.
+
+    Считается при первом вызове в процессе, а не при импорте: воркеры
+    создаются fork-ом уже после импорта модулей и иначе получили бы pid родителя.
+    """
+    global _worker_id
+    pid = os.getpid()
+    if _worker_id is None or _worker_id[0] != pid:
+        _worker_id = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}")
+    return _worker_id[1]
+
+
+class Lease:
+    def __init__(self, name: str, ttl: int = 30, renew_every: int = 10, holder: str | None = None):
+        self.name = name
+        self.ttl = ttl
+        self.renew_every = renew_every
+        self.holder = holder or worker_id()
+
+    async def _acquire(self) -> bool:
+        try:
+            return await db.try_acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.error(f"Ошибка при продлении lease {self.name}: {e}")
+            return False
+
+    async def run_as_leader(self, job: Callable[[], Awaitable[None]]):
+        """Бесконечно пытается стать ведущим и, пока им является, выполняет job()."""
+        while True:
+            if await self._acquire():
+                logger.info("Процесс %s стал ведущим для %s", self.holder, self.name)
+                task = asyncio.create_task(job())
+                try:
+                    while True:
+                        done, _ = await asyncio.wait({task}, timeout=self.renew_every)
+                        if done:
+                            if task.exception():
+                                logger.error(f"Задача {self.name} упала: {task.exception()}")
+                            break
+                        if not await self._acquire():
+                            logger.warning("Процесс %s потерял lease %s", self.holder, self.name)
+                            break
+                finally:
+                    task.cancel()
+                    with suppress(asyncio.CancelledError, Exception):
+                        await task
+                    with suppress(Exception):
+                        await db.release_lease(self.name, self.holder)
+            await asyncio.sleep(self.renew_every)
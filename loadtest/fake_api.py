@@ -0,0 +1,115 @@
+# loadtest/fake_api.py
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Принимает запросы aiogram по адресу /bot<token>/<method>, записывает их,
+добавляет искусственную задержку и с заданной вероятностью отвечает
+429 Too Many Requests с retry_after — как настоящий API под нагрузкой.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+
+MESSAGE_METHODS = {
+    "sendmessage", "sendphoto", "senddocument", "editmessagetext",
+    "editmessagecaption", "editmessagereplymarkup", "copymessage",
+}
+
+
+@dataclass
+class ApiCall:
+    method: str
+    params: dict
+    at: float
+
+
+@dataclass
+class FakeBotAPI:
+    """Поведение заглушки: задержка ответа (сек) и доля ответов 429."""
+    latency: float = 0.03
+    jitter: float = 0.02
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    calls: list[ApiCall] = field(default_factory=list)
+    flood_responses: int = 0
+    _message_ids: itertools.count = field(default_factory=lambda: itertools.count(1000))
+    _runner: web.AppRunner | None = None
+
+    def counts(self) -> Counter:
+        return Counter(c.method for c in self.calls)
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 1)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    def _result(self, method: str, params: dict):
+        if method == "getme":
+            return BOT_USER
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == "createchatinvitelink":
+            return {
+                "invite_link": f"https://t.me/+fake{next(self._message_ids)}",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False,
+                "name": params.get("name"),
+                "expire_date": int(params["expire_date"]) if params.get("expire_date") else None,
+                "member_limit": int(params["member_limit"]) if params.get("member_limit") else None,
+            }
+        if method == "getchatmember":
+            return {"status": "member", "user": {"id": int(params.get("user_id", 0)), "is_bot": False,
+                                                 "first_name": "user"}}
+        if method == "getupdates":
+            return []
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        self.calls.append(ApiCall(method, params, time.monotonic()))
+
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.flood_responses += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        return web.json_response({"ok": True, "result": self._result(method, params)},
+                                 dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> str:
+        """Запускает сервер и возвращает его базовый адрес."""
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
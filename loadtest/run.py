@@ -0,0 +1,231 @@
+# loadtest/run.py
+"""Нагрузочный прогон хендлеров бота против локальной заглушки Bot API.
+
+Пример:
+    python -m loadtest.run --rate 50 --duration 30 --latency 0.05 --flood-rate 0.01 --expired 2000
+
+Генератор с заданной частотой запускает сценарии синтетических пользователей
+(/start; оферта → тариф → заявка → чек → контакты → подтверждение админом;
+успешная оплата через инвойс), подаёт обновления в Dispatcher и измеряет время
+обработки каждого обновления. Опционально замеряет проход шедулера по
+`--expired` истёкшим подпискам. В конце печатает p50/p99 по типам обновлений,
+пропускную способность и статистику вызовов API.
+"""
+import os
+
+# Значения по умолчанию для прогона; задаются до импорта config
+os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+os.environ.setdefault("ADMIN_ID", "999")
+os.environ.setdefault("PRIVATE_GROUP_CHAT_ID", "-1001")
+
+import argparse
+import asyncio
+import itertools
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.bot import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, SuccessfulPayment, Update, User
+
+import config
+import db
+import idempotency
+import outbox
+from admin_digest import admin_digest
+from callbacks import AcceptOffer, AttachReceipt, CreatePending, Decision, Offer, Service
+from fsm_storage import create_storage
+from handlers import routers
+from loadtest.fake_api import FakeBotAPI
+
+# update_id уникальны между запусками: повторы отсеивает idempotency.UpdateDedupMiddleware
+_ids = itertools.count(int(time.time() * 1000))
+
+
+def _user(uid: int) -> User:
+    return User(id=uid, is_bot=False, first_name=f"user{uid}", username=f"user{uid}")
+
+
+def _message(uid: int, **fields) -> Message:
+    return Message(message_id=next(_ids), date=datetime.now(), chat=Chat(id=uid, type="private"),
+                   from_user=_user(uid), **fields)
+
+
+def message_update(uid: int, **fields) -> Update:
+    return Update(update_id=next(_ids), message=_message(uid, **fields))
+
+
+def callback_update(uid: int, data: str, **message_fields) -> Update:
+    message_fields.setdefault("text", "menu")
+    return Update(update_id=next(_ids), callback_query=CallbackQuery(
+        id=str(next(_ids)), from_user=_user(uid), chat_instance="loadtest", data=data,
+        message=_message(uid, **message_fields),
+    ))
+
+
+class LoadRunner:
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+        self._uids = itertools.count(10_000_000)
+
+    async def feed(self, label: str, update: Update):
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.errors += 1
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def scenario_start(self):
+        await self.feed("start", message_update(next(self._uids), text="/start"))
+
+    async def scenario_purchase(self):
+        uid = next(self._uids)
+        await self.feed("buy_subscription", callback_update(uid, Offer(service=Service.subscription).pack()))
+        await self.feed("accept_offer", callback_update(uid, AcceptOffer(service=Service.subscription).pack()))
+        await self.feed("create_pending", callback_update(
+            uid, CreatePending(service=Service.subscription, amount=50000).pack()
+        ))
+        pending = await db.get_pending_by_user(uid)
+        if pending is None:
+            self.errors += 1
+            return
+        pid = pending["id"]
+        await self.feed("attach_receipt", callback_update(uid, AttachReceipt(pid=pid).pack()))
+        await self.feed("receipt", message_update(
+            uid, photo=[PhotoSize(file_id=f"AgAC{pid}", file_unique_id=str(pid), width=1, height=1)]
+        ))
+        await self.feed("contacts", message_update(uid, text="+79991234567\nuser@example.com"))
+        await self.feed("approve", callback_update(config.ADMIN_ID, Decision(pid=pid, approve=True).pack(),
+                                                   text=None, caption=f"Заявка #{pid}"))
+
+    async def scenario_payment(self):
+        uid = next(self._uids)
+        await self.feed("successful_payment", message_update(uid, successful_payment=SuccessfulPayment(
+            currency="RUB", total_amount=50000, invoice_payload="month_subscription",
+            telegram_payment_charge_id=f"tg{uid}", provider_payment_charge_id=f"pr{uid}",
+        )))
+
+    async def run(self, rate: float, duration: float, mix: dict[str, float]) -> float:
+        """Открытая модель нагрузки: сценарии стартуют с частотой `rate` в секунду."""
+        scenarios = {
+            "start": self.scenario_start,
+            "purchase": self.scenario_purchase,
+            "payment": self.scenario_payment,
+        }
+        names = list(mix)
+        weights = [mix[n] for n in names]
+        tasks = []
+        started = time.perf_counter()
+        deadline = started + duration
+        next_at = started
+        while (now := time.perf_counter()) < deadline:
+            if now < next_at:
+                await asyncio.sleep(next_at - now)
+            name = random.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(scenarios[name]()))
+            next_at += 1 / rate
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * (len(values) - 1)))]
+
+
+def report(runner: LoadRunner, wall: float, api: FakeBotAPI):
+    total = sum(len(v) for v in runner.latencies.values())
+    print(f"\n{'update':<20}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, values in sorted(runner.latencies.items()):
+        print(f"{label:<20}{len(values):>8}{_percentile(values, 0.5) * 1000:>10.1f}"
+              f"{_percentile(values, 0.99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    print(f"\nобновлений: {total}, ошибок: {runner.errors}, время: {wall:.1f} с, "
+          f"пропускная способность: {total / wall:.1f} upd/s")
+    print(f"вызовов API: {len(api.calls)}, ответов 429: {api.flood_responses}")
+    for method, n in api.counts().most_common():
+        print(f"  {method:<28}{n:>8}")
+
+
+async def sweep(bot: Bot, expired: int, api: FakeBotAPI):
+    """Замер прохода шедулера по `expired` истёкшим подпискам."""
+    import scheduler
+
+    now = int(time.time())
+    async with db.transaction() as conn:
+        await conn.executemany(
+            "INSERT INTO users (tg_id, username, subscription_end, in_group) VALUES (?, ?, ?, 1)",
+            [(20_000_000 + i, f"expired{i}", now - 60) for i in range(expired)],
+        )
+    calls_before = len(api.calls)
+    started = time.perf_counter()
+    await scheduler.check_subscriptions(bot)
+    took = time.perf_counter() - started
+    print(f"\nшедулер: {expired} истёкших подписок за {took:.2f} с "
+          f"({expired / took:.1f} польз./с, вызовов API: {len(api.calls) - calls_before})")
+
+
+def _parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=20, help="сценариев в секунду")
+    parser.add_argument("--duration", type=float, default=10, help="длительность прогона, сек")
+    parser.add_argument("--mix", type=_parse_mix, default="start=5,purchase=3,payment=2",
+                        help="веса сценариев, например start=5,purchase=3,payment=2")
+    parser.add_argument("--latency", type=float, default=0.03, help="задержка ответа заглушки API, сек")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--expired", type=int, default=0, help="замерить шедулер на N истёкших подписках")
+    parser.add_argument("--database-url", default=None, help="по умолчанию — временный файл SQLite")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    db.DATABASE_URL = args.database_url or f"sqlite:///{tempfile.mktemp(suffix='.db', prefix='loadtest_')}"
+    await db.init_db()
+
+    api = FakeBotAPI(latency=args.latency, flood_rate=args.flood_rate)
+    base_url = await api.start(port=args.port)
+    bot = Bot(
+        token=config.BOT_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)),
+        default=DefaultBotProperties(parse_mode="HTML"),
+    )
+    dp = Dispatcher(storage=create_storage())
+    for r in routers:
+        dp.include_router(r)
+    # Антифлуд (throttling) не подключаем: сценарий шлёт апдейты одного пользователя
+    # быстрее живого человека и упёрся бы в лимит
+    idempotency.setup(dp)
+    digest_task = asyncio.create_task(admin_digest.run(bot))
+    outbox_task = asyncio.create_task(outbox.run_dispatcher(bot))
+
+    try:
+        runner = LoadRunner(dp, bot)
+        wall = await runner.run(args.rate, args.duration, args.mix)
+        report(runner, wall, api)
+        if args.expired:
+            await sweep(bot, args.expired, api)
+    finally:
+        digest_task.cancel()
+        outbox_task.cancel()
+        await bot.session.close()
+        await api.stop()
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+# logging_setup.py
+"""Неблокирующее логирование через очередь.
+
+Корневой логгер пишет записи в QueueHandler (без ввода-вывода в event loop),
+а QueueListener в отдельном потоке отдаёт их в файл с ротацией по размеру и
+в консоль. В файл пишется JSON — по строке на запись. Записи массовых
+событий (логгеры из LOG_SAMPLED_LOGGERS и записи с extra={"sample": True})
+уровня ниже WARNING прореживаются до доли LOG_SAMPLE_RATE.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+from datetime import datetime
+
+import config
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra и попадает в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_exc_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение, поля из extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sample":
+                entry[key] = value
+        # После QueueHandler трассировка приходит уже текстом в exc_text
+        exc_text = self.formatException(record.exc_info) if record.exc_info else record.exc_text
+        if exc_text:
+            entry["exc_info"] = exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TracebackQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который передаёт трассировку исключения отдельным полем exc_text.
+
+    Стандартный prepare() вклеивает трассировку в текст сообщения и обнуляет
+    exc_info, из-за чего в JSON она терялась как отдельное поле.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+        # Объекты трассировки держат ссылки на кадры стека — в очередь их не передаём
+        record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю `rate` массовых записей уровня ниже WARNING."""
+
+    def __init__(self, rate: float, loggers: tuple[str, ...]):
+        super().__init__()
+        self.rate = rate
+        self.loggers = loggers
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        if getattr(record, "sample", False) or record.name in self.loggers:
+            return random.random() < self.rate
+        return True
+
+
+def setup_logging(worker_index: int = 0) -> logging.handlers.QueueListener:
+    """Настраивает корневой логгер и запускает поток записи; вызывающий останавливает listener."""
+    log_file = config.LOG_FILE
+    if config.WORKERS > 1:
+        # RotatingFileHandler не умеет ротировать один файл из нескольких процессов
+        base, dot, ext = log_file.rpartition(".")
+        log_file = f"{base}.{worker_index}.{ext}" if dot else f"{log_file}.{worker_index}"
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+    console_handler = logging.StreamHandler()
+    text_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    file_handler.setFormatter(JsonFormatter() if config.LOG_FORMAT == "json" else text_formatter)
+    console_handler.setFormatter(text_formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(config.LOG_SAMPLE_RATE, config.LOG_SAMPLED_LOGGERS))
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(config.LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
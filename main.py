@@ -1,42 +1,119 @@
 import asyncio
 import logging
+import multiprocessing
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.bot import DefaultBotProperties
+import broadcast
 import config
+import db
+import idempotency
+from admin_digest import admin_digest
+from fsm_storage import create_storage, run_pruner
+import invite_pool
+import metrics
+import outbox
+import ratelimit
+import throttling
 from handlers import routers
+from leader import Lease
+from logging_setup import setup_logging
 from scheduler import start_scheduler
+import webhook
 
+logger = logging.getLogger(__name__)
+
+
+def _log_task_exit(task: asyncio.Task):
+    # Фоновые задачи бесконечны: завершение без отмены — это ошибка
+    if task.cancelled():
+        return
+    if task.exception():
+        logger.error("Фоновая задача %s упала", task.get_name(), exc_info=task.exception())
+    else:
+        logger.error("Фоновая задача %s неожиданно завершилась", task.get_name())
 
-async def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        handlers=[
-            logging.FileHandler("bot.log", encoding="utf-8"),
-            logging.StreamHandler()
-        ]
-    )
+
+async def main(worker_index: int = 0):
+    log_listener = setup_logging(worker_index)
 
     bot = Bot(
         token=config.BOT_TOKEN,
         default=DefaultBotProperties(parse_mode="HTML")
     )
-    dp = Dispatcher()
+    storage = create_storage()
+    dp = Dispatcher(storage=storage)
 
     for r in routers:
         dp.include_router(r)
+    throttling.setup(dp)
+    idempotency.setup(dp)
+    metrics.setup(dp, bot)
+
+    await db.init_db()
+    await db.listen_user_cache_invalidations()
+    if config.METRICS_PORT:
+        await metrics.start_server(config.WEBAPP_HOST, config.METRICS_PORT + worker_index)
 
-    print("Бот запущен...")
+    logger.info("Бот запущен (воркер %s)", worker_index)
 
-    # Запускаем шедулер параллельно с polling
-    asyncio.create_task(start_scheduler(bot))
+    # Запускаем шедулер и прочие фоновые задачи параллельно с приёмом обновлений
+    background = {
+        asyncio.create_task(coro, name=name)
+        for name, coro in (
+            ("budget", ratelimit.run_budget()),
+            ("scheduler", start_scheduler(bot)),
+            ("admin_digest", Lease("admin_digest").run_as_leader(lambda: admin_digest.run(bot))),
+            ("fsm_pruner", run_pruner(storage)),
+            ("idempotency_pruner", idempotency.run_pruner()),
+            ("invite_pool", Lease("invite_pool").run_as_leader(lambda: invite_pool.run_refiller(bot))),
+            ("outbox", Lease("outbox").run_as_leader(lambda: outbox.run_dispatcher(bot))),
+            ("broadcast", Lease("broadcast").run_as_leader(lambda: broadcast.run(bot))),
+        )
+    }
+    for task in background:
+        task.add_done_callback(_log_task_exit)
 
     try:
-        await dp.start_polling(bot)
+        if config.BOT_MODE == "webhook":
+            await webhook.run_webhook(dp, bot, worker_index)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
         await bot.session.close()
+        await db.close()
+        log_listener.stop()
+
+
+def run_worker(worker_index: int):
+    asyncio.run(main(worker_index))
+
+
+def run_workers():
+    """Запускает WORKERS процессов; фоновые задачи выполняет только ведущий из них."""
+    if config.BOT_MODE != "webhook":
+        raise SystemExit("Несколько воркеров поддерживаются только в режиме BOT_MODE=webhook")
+    if config.FSM_STORAGE != "db":
+        raise SystemExit("Для нескольких воркеров нужно общее хранилище состояний: FSM_STORAGE=db")
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(i,), name=f"bot-worker-{i}")
+        for i in range(config.WORKERS)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if config.BOT_MODE == "webhook":
+        webhook.check_config()
+    if config.WORKERS > 1:
+        run_workers()
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,276 @@
+# metrics.py
+"""Метрики в текстовом формате Prometheus.
+
+Счётчики и гистограммы живут в памяти процесса и отдаются на /metrics
+(webhook-приложение или отдельный сервер на METRICS_PORT + номер воркера).
+Инструментированы обработчики aiogram, вызовы db.*, запросы к Bot API и
+проход шедулера.
+"""
+import bisect
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from aiohttp import web
+
+import callbacks
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[n] for n in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ])
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Значение без меток, вычисляемое функцией в момент сбора.
+
+    kind="counter" — для уже существующих монотонных счётчиков (например, LRUCache.hits).
+    """
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float], kind: str = "gauge"):
+        super().__init__(name, documentation)
+        self.function = function
+        self.kind = kind
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {self.function()}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, data in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, data):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {data[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# ===== Метрики =====
+
+handler_duration = Histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта хендлером", ("handler", "event", "prefix")
+)
+handler_errors = Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ("handler", "event", "prefix")
+)
+db_duration = Histogram("bot_db_call_duration_seconds", "Время вызова функций db.*", ("function",))
+db_errors = Counter("bot_db_call_errors_total", "Исключения в функциях db.*", ("function",))
+telegram_duration = Histogram(
+    "bot_telegram_request_duration_seconds", "Время запроса к Bot API", ("method",)
+)
+telegram_errors = Counter(
+    "bot_telegram_request_errors_total", "Ошибки запросов к Bot API (429 — error=\"retry_after\")",
+    ("method", "error"),
+)
+scheduler_expired = Counter("bot_scheduler_expired_total", "Найдено истёкших подписок")
+scheduler_kicked = Counter("bot_scheduler_kicked_total", "Удалено пользователей из группы")
+scheduler_kick_failed = Counter("bot_scheduler_kick_failed_total", "Неудачные удаления из группы")
+scheduler_sweep_duration = Histogram(
+    "bot_scheduler_sweep_duration_seconds", "Длительность прохода по истёкшим подпискам",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
+
+
+# ===== Инструментирование =====
+
+# Внутри уже измеряемого вызова db.* вложенные вызовы db.* не измеряются:
+# иначе их время попало бы в гистограмму дважды
+_in_timed_db: contextvars.ContextVar[bool] = contextvars.ContextVar("in_timed_db", default=False)
+
+
+def timed_db(name: str):
+    """Декоратор для корутин db.*: время и ошибки по имени функции (только внешний вызов)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if _in_timed_db.get():
+                return await fn(*args, **kwargs)
+            token = _in_timed_db.set(True)
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                db_errors.inc(function=name)
+                raise
+            finally:
+                db_duration.observe(time.perf_counter() - started, function=name)
+                _in_timed_db.reset(token)
+        return wrapper
+    return decorator
+
+
+def _handler_labels(callback: Callable, event: TelegramObject) -> tuple[str, str]:
+    """Имя хендлера и префикс события для меток.
+
+    Все нажатия принимает callbacks.dispatch, поэтому для CallbackQuery берём
+    обработчик и префикс фабрики из таблицы callbacks — так набор значений
+    ограничен, а время видно по каждому обработчику. Для сообщений префикс —
+    тип содержимого.
+    """
+    prefix = ""
+    if isinstance(event, CallbackQuery):
+        target = callbacks.resolve(event.data or "")
+        if target is not None:
+            prefix, callback = target
+    elif isinstance(event, Message):
+        prefix = event.content_type.value
+    return f"{callback.__module__}.{callback.__name__}", prefix
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner-middleware: время каждого сработавшего хендлера с метками handler / event / prefix."""
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_name, prefix = _handler_labels(data["handler"].callback, event)
+        labels = {"handler": handler_name, "event": self.event, "prefix": prefix}
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(**labels)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, **labels)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки каждого запроса к Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            telegram_errors.inc(method=name, error="retry_after")
+            raise
+        except TelegramNetworkError:
+            telegram_errors.inc(method=name, error="network")
+            raise
+        except TelegramAPIError as e:
+            telegram_errors.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            telegram_duration.observe(time.perf_counter() - started, method=name)
+
+
+def setup(dp, bot):
+    """Подключает middleware метрик к диспетчеру и сессии бота."""
+    for event in ("message", "callback_query", "pre_checkout_query", "chat_member"):
+        dp.observers[event].middleware(HandlerMetricsMiddleware(event))
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный HTTP-сервер только с /metrics (polling и несколько воркеров)."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
@@ -0,0 +1,315 @@
+# migrations.py
+"""Версионированные миграции схемы БД.
+
+Вся DDL (таблицы, колонки, индексы) и переносы данных живут здесь и
+выполняются один раз при старте (db.init_db / init_db.py) — обработчики
+запросов схему не трогают. Номера применённых миграций хранятся в
+schema_migrations. Каждая миграция выполняется в своей транзакции вместе с
+записью о ней под блокировкой (BEGIN IMMEDIATE в SQLite, advisory lock в
+PostgreSQL), поэтому при одновременном старте нескольких воркеров её
+применит только один.
+
+Базы, созданные до появления schema_migrations, уже содержат часть схемы,
+поэтому миграции проверяют наличие колонок и используют IF NOT EXISTS.
+Новая миграция добавляется в конец с очередным номером; применённые не
+меняются.
+"""
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Типы колонок, которые различаются между SQLite и PostgreSQL
+DDL = {
+    "sqlite": {
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "bigint": "INTEGER",
+        "now": "(datetime('now'))",
+    },
+    "postgres": {
+        "id": "BIGSERIAL PRIMARY KEY",
+        "bigint": "BIGINT",
+        "now": "(to_char(now(), 'YYYY-MM-DD HH24:MI:SS'))",
+    },
+}
+
+# Ключ pg_advisory_xact_lock, под которым применяются миграции
+_PG_LOCK_KEY = 0x6D696772
+
+Migration = Callable[..., Awaitable[None]]
+# (версия, имя, функция(conn, dialect)) по возрастанию версии
+MIGRATIONS: list[tuple[int, str, Migration]] = []
+
+
+def migration(version: int, name: str):
+    """Регистрирует миграцию; версии идут подряд начиная с 1."""
+    def decorator(fn: Migration) -> Migration:
+        assert version == len(MIGRATIONS) + 1, f"миграция {version} объявлена не по порядку"
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return decorator
+
+
+async def column_type(conn, dialect: str, table: str, column: str) -> str | None:
+    if dialect == "sqlite":
+        for row in await conn.fetch(f"PRAGMA table_info({table})"):
+            if row["name"] == column:
+                return row["type"].upper()
+        return None
+    return await conn.fetchval("""
+        SELECT upper(data_type) FROM information_schema.columns
+        WHERE table_name = ? AND column_name = ?
+    """, table, column)
+
+
+async def add_column_if_missing(conn, dialect: str, table: str, column: str, type_: str):
+    if await column_type(conn, dialect, table, column) is None:
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_}")
+
+
+# ===== Миграции =====
+
+@migration(1, "initial_schema")
+async def _initial_schema(conn, dialect: str):
+    t = DDL[dialect]
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS users (
+        tg_id {t["bigint"]} PRIMARY KEY,
+        username TEXT,
+        subscription_end {t["bigint"]}, -- unix epoch, секунды
+        in_group INTEGER DEFAULT 0,
+        notify_7_days INTEGER DEFAULT 0,
+        notify_1_day INTEGER DEFAULT 0,
+        last_invoice_time TEXT
+    )
+    """)
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS invite_links (
+        id {t["id"]},
+        tg_id {t["bigint"]},
+        invite_link TEXT UNIQUE,
+        created_at TEXT DEFAULT {t["now"]},
+        used INTEGER DEFAULT 0,
+        expire_at {t["bigint"]}, -- unix epoch, для ссылок из пула
+        issued_at {t["bigint"]}
+    )
+    """)
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS agreements (
+        id {t["id"]},
+        tg_id {t["bigint"]},
+        username TEXT,
+        offer_type TEXT,
+        offer_version TEXT,
+        accepted_at TEXT
+    )
+    """)
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS pending_payments (
+        id {t["id"]},
+        tg_id {t["bigint"]},
+        username TEXT,
+        plan TEXT,
+        amount INTEGER,
+        status TEXT DEFAULT 'pending', -- pending, awaiting_review, confirmed, rejected, cancelled
+        proof_file_id TEXT,
+        created_at TEXT DEFAULT {t["now"]},
+        admin_id {t["bigint"]},
+        admin_note TEXT,
+        phone TEXT,
+        email TEXT
+    )
+    """)
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at {t["bigint"]}
+    )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_expires_at ON fsm_states (expires_at)")
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT,
+        expires_at {t["bigint"]}
+    )
+    """)
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id {t["id"]},
+        chat_id {t["bigint"]},
+        method TEXT,  -- имя метода из aiogram.methods, например SendMessage
+        payload TEXT,  -- параметры метода в JSON
+        fallback_method TEXT,  -- запасной вызов, если Telegram отклонил основной (400)
+        fallback_payload TEXT,
+        status TEXT DEFAULT 'pending',  -- pending, failed
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at {t["bigint"]},
+        last_error TEXT,
+        created_at {t["bigint"]}
+    )
+    """)
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_outbox_status_next_attempt_at
+    ON outbox (status, next_attempt_at)
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_chat_id ON outbox (chat_id, id)")
+
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id {t["id"]},
+        admin_id {t["bigint"]},
+        from_chat_id {t["bigint"]},  -- рассылаемое сообщение копируется из чата админа
+        message_id {t["bigint"]},
+        status TEXT DEFAULT 'running',  -- running, done, cancelled
+        last_tg_id {t["bigint"]} DEFAULT 0,  -- контрольная точка: до него включительно отправлено
+        delivered INTEGER DEFAULT 0,
+        blocked INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        created_at {t["bigint"]},
+        finished_at {t["bigint"]}
+    )
+    """)
+
+
+@migration(2, "users_subscription_end_epoch")
+async def _users_subscription_end_epoch(conn, dialect: str):
+    """Переводит users.subscription_end из строки '%Y-%m-%d %H:%M:%S' в unix epoch (INTEGER)."""
+    if await column_type(conn, dialect, "users", "subscription_end") == "TEXT":
+        await conn.execute(f"ALTER TABLE users ADD COLUMN subscription_end_epoch {DDL[dialect]['bigint']}")
+        rows = await conn.fetch("SELECT tg_id, subscription_end FROM users WHERE subscription_end IS NOT NULL")
+        converted = []
+        for row in rows:
+            try:
+                converted.append((int(datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S").timestamp()), row[0]))
+            except (TypeError, ValueError):
+                continue
+        await conn.executemany("UPDATE users SET subscription_end_epoch = ? WHERE tg_id = ?", converted)
+        await conn.execute("ALTER TABLE users DROP COLUMN subscription_end")
+        await conn.execute("ALTER TABLE users RENAME COLUMN subscription_end_epoch TO subscription_end")
+
+    # Выборки истёкших / истекающих подписок — диапазонные поиски по индексу.
+    # Индексы создаются после перевода: SQLite не удаляет колонку, на которую есть индекс
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_users_in_group_subscription_end
+    ON users (in_group, subscription_end)
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users (subscription_end)")
+
+
+@migration(3, "users_reminder_flags")
+async def _users_reminder_flags(conn, dialect: str):
+    await add_column_if_missing(conn, dialect, "users", "notify_7_days", "INTEGER DEFAULT 0")
+    await add_column_if_missing(conn, dialect, "users", "notify_1_day", "INTEGER DEFAULT 0")
+
+
+@migration(4, "invite_links_pool")
+async def _invite_links_pool(conn, dialect: str):
+    await add_column_if_missing(conn, dialect, "invite_links", "expire_at", DDL[dialect]["bigint"])
+    await add_column_if_missing(conn, dialect, "invite_links", "issued_at", DDL[dialect]["bigint"])
+    await conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_invite_links_used_expire_at
+    ON invite_links (used, expire_at)
+    """)
+
+
+@migration(5, "pending_payments_contacts")
+async def _pending_payments_contacts(conn, dialect: str):
+    # Раньше эти колонки добавлял update_payment_contacts при каждом вызове
+    await add_column_if_missing(conn, dialect, "pending_payments", "phone", "TEXT")
+    await add_column_if_missing(conn, dialect, "pending_payments", "email", "TEXT")
+
+
+@migration(6, "processed_updates")
+async def _processed_updates(conn, dialect: str):
+    # Ключи уже обработанных событий: "update:<update_id>", "charge:<telegram_payment_charge_id>"
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS processed_updates (
+        key TEXT PRIMARY KEY,
+        processed_at {DDL[dialect]["bigint"]}
+    )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_updates_processed_at ON processed_updates (processed_at)")
+
+
+@migration(7, "pending_payments_status_id")
+async def _pending_payments_status_id(conn, dialect: str):
+    # Очередь проверки чеков: WHERE status = ? AND id > ? ORDER BY id (keyset-пагинация)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_payments_status_id ON pending_payments (status, id)")
+
+
+@migration(8, "admin_events")
+async def _admin_events(conn, dialect: str):
+    # События для сводки админу (admin_digest) ждут отправки здесь, а не в памяти процесса
+    t = DDL[dialect]
+    await conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS admin_events (
+        id {t["id"]},
+        kind TEXT,
+        text TEXT,
+        tg_id {t["bigint"]},
+        username TEXT,
+        created_at {t["bigint"]}
+    )
+    """)
+
+
+@migration(9, "users_kick_pending")
+async def _users_kick_pending(conn, dialect: str):
+    # 1 — подписка истекла и шедулер забрал пользователя, но удаление из группы ещё не подтверждено
+    await add_column_if_missing(conn, dialect, "users", "kick_pending", "INTEGER DEFAULT 0")
+
+
+# ===== Применение =====
+
+@asynccontextmanager
+async def _locked_transaction(conn, dialect: str):
+    async with conn.transaction():
+        # В SQLite транзакция открывается BEGIN IMMEDIATE и уже держит блокировку записи
+        if dialect == "postgres":
+            await conn.execute("SELECT pg_advisory_xact_lock(?)", _PG_LOCK_KEY)
+        yield
+
+
+async def _applied_versions(conn) -> set[int]:
+    return {row[0] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+
+async def migrate(conn, dialect: str) -> list[int]:
+    """Применяет недостающие миграции по порядку; возвращает номера применённых сейчас."""
+    async with _locked_transaction(conn, dialect):
+        await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at {DDL[dialect]["bigint"]}
+        )
+        """)
+    applied = await _applied_versions(conn)
+    applied_now = []
+    for version, name, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        async with _locked_transaction(conn, dialect):
+            # Повторная проверка под блокировкой: миграцию мог применить другой воркер
+            if await conn.fetchval("SELECT 1 FROM schema_migrations WHERE version = ?", version):
+                continue
+            logger.info("Применяю миграцию %s_%s", version, name)
+            await fn(conn, dialect)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                version, name, int(datetime.now().timestamp()),
+            )
+        applied_now.append(version)
+    return applied_now
+
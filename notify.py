@@ -6,7 +6,7 @@ cur = conn.cursor()
 
 tg_id = 799106955  # твой тестовый ID
 username = "quatryh"
-subscription_end = (datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
+subscription_end = int((datetime.now() + timedelta(days=7)).timestamp())
 
 cur.execute(
     "INSERT OR REPLACE INTO users (tg_id, username, subscription_end, in_group) VALUES (?, ?, ?, ?)",
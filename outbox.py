@@ -0,0 +1,138 @@
+# outbox.py
+"""Транзакционная очередь исходящих сообщений (outbox).
+
+Обработчики не отправляют уведомления сами, а записывают вызовы Bot API в
+таблицу outbox в той же транзакции, что и изменение данных (статус платежа,
+подписка и т.п.). Фоновый диспетчер в ведущем процессе забирает очередь
+пачками и отправляет её через ratelimit, соблюдая порядок сообщений внутри
+чата. Неудачные отправки повторяются с экспоненциальной задержкой.
+
+Доставка «как минимум один раз»: если процесс упадёт между отправкой и
+удалением записи, сообщение уйдёт повторно.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextlib import suppress
+
+import aiogram.methods
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import SendMessage, TelegramMethod
+
+import db
+from ratelimit import call_with_retry, run_pool
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений забираем из БД за проход и во сколько чатов шлём параллельно
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_CONCURRENCY = 20
+# Как часто проверять очередь, если о новых сообщениях не сообщили
+POLL_INTERVAL = 1
+# После стольких неудачных попыток сообщение помечается failed
+MAX_ATTEMPTS = 8
+MAX_RETRY_DELAY = 60 * 60
+
+_wake = asyncio.Event()
+
+
+def _dump(method: TelegramMethod) -> tuple[str, str]:
+    # Значения по умолчанию (в т.ч. parse_mode из DefaultBotProperties) не сохраняем,
+    # чтобы при отправке они подставились из настроек бота
+    return type(method).__name__, method.model_dump_json(exclude_defaults=True)
+
+
+def _load(name: str, payload: str) -> TelegramMethod:
+    return getattr(aiogram.methods, name).model_validate_json(payload)
+
+
+async def enqueue(method: TelegramMethod, fallback: TelegramMethod | None = None):
+    """Ставит вызов Bot API в очередь.
+
+    Внутри `async with db.transaction()` запись фиксируется вместе с остальными
+    изменениями. fallback отправляется вместо method, если Telegram отклонил его
+    с ошибкой 400 (например, недоступный file_id).
+    """
+    name, payload = _dump(method)
+    fallback_name, fallback_payload = _dump(fallback) if fallback else (None, None)
+    await db.enqueue_outbox(method.chat_id, name, payload, fallback_name, fallback_payload)
+    db.after_commit(_wake.set)
+
+
+async def enqueue_many(methods: list[TelegramMethod]):
+    """Ставит в очередь пачку вызовов одним executemany."""
+    await db.enqueue_outbox_many([(method.chat_id, *_dump(method)) for method in methods])
+    db.after_commit(_wake.set)
+
+
+async def send_message(chat_id: int, text: str, **kwargs):
+    """Аналог bot.send_message, но через очередь."""
+    await enqueue(SendMessage(chat_id=chat_id, text=text, **kwargs))
+
+
+async def _deliver_chat(bot: Bot, rows: list, delivered: list[int]):
+    """Отправляет сообщения одного чата по порядку; на первой временной ошибке останавливается."""
+    for row in rows:
+        try:
+            await call_with_retry(row["chat_id"], bot, _load(row["method"], row["payload"]))
+        except TelegramForbiddenError as e:
+            # Пользователь заблокировал бота — повторять бессмысленно
+            logger.warning("Сообщение %s в чат %s не доставлено: %s", row["id"], row["chat_id"], e)
+            await db.fail_outbox(row["id"], str(e))
+        except TelegramBadRequest as e:
+            if row["fallback_method"]:
+                await db.use_outbox_fallback(row["id"], str(e))
+                return
+            logger.error(f"Telegram отклонил сообщение {row['id']} в чат {row['chat_id']}: {e}")
+            await db.fail_outbox(row["id"], str(e))
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            if attempts >= MAX_ATTEMPTS:
+                logger.error(f"Сообщение {row['id']} в чат {row['chat_id']} не доставлено после {attempts} попыток: {e}")
+                await db.fail_outbox(row["id"], str(e))
+                continue
+            delay = min(2 ** attempts * 5, MAX_RETRY_DELAY)
+            await db.retry_outbox(row["id"], attempts, int(time.time()) + delay, str(e))
+            return
+        else:
+            delivered.append(row["id"])
+
+
+async def deliver_batch(bot: Bot) -> int:
+    """Отправляет одну пачку готовых сообщений; возвращает её размер."""
+    rows = await db.get_due_outbox(int(time.time()), OUTBOX_BATCH_SIZE)
+    if not rows:
+        return 0
+
+    by_chat: dict[int, list] = defaultdict(list)
+    for row in rows:
+        by_chat[row["chat_id"]].append(row)
+
+    delivered: list[int] = []
+    try:
+        await run_pool(
+            by_chat.values(),
+            lambda chat_rows: _deliver_chat(bot, chat_rows, delivered),
+            concurrency=OUTBOX_CONCURRENCY,
+        )
+    finally:
+        if delivered:
+            await db.delete_outbox(delivered)
+    return len(rows)
+
+
+async def run_dispatcher(bot: Bot):
+    """Разбирает очередь: сразу после постановки сообщений или раз в POLL_INTERVAL секунд."""
+    while True:
+        _wake.clear()
+        try:
+            count = await deliver_batch(bot)
+        except Exception as e:
+            logger.error(f"Ошибка отправки очереди сообщений: {e}")
+            count = 0
+        # Полная пачка — в очереди, скорее всего, есть ещё
+        if count < OUTBOX_BATCH_SIZE:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(_wake.wait(), timeout=POLL_INTERVAL)
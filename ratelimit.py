@@ -0,0 +1,191 @@
+# ratelimit.py
+"""Ограничение частоты запросов к Telegram Bot API.
+
+Лимиты Telegram: ~30 сообщений в секунду суммарно, 1 сообщение в секунду
+в один личный чат и 20 сообщений в минуту в одну группу. При превышении
+API отвечает 429 с retry_after — в этом случае все отправки ставятся на паузу.
+
+Бюджет делится на две части. Запросы, которые делает обработчик апдейта
+(ссылка при пустом пуле, удаление вошедшего с истёкшей подпиской, выгрузки
+админа), идут через request_limiter — у каждого воркера свои REQUEST_RATE,
+чтобы такой запрос не ждал в очереди за рассылкой. Массовые отправители
+(outbox, рассылки, шедулер) работают только в процессах, держащих lease, и
+идут через telegram_limiter: остаток бюджета делят между собой держатели
+lease (run_budget пересчитывает доли по таблице leases), процессам без lease
+остаётся IDLE_RATE.
+
+Ответы на сами апдейты (message.answer, callback.answer, правки экранов)
+через лимитеры не проходят — их частоту сдерживает throttling на
+пользователя, — так что суммарные GLOBAL_RATE соблюдаются приблизительно.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+
+import config
+import db
+from leader import worker_id
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+# Запросы из обработчиков апдейтов — отдельно в каждом воркере
+REQUEST_RATE = 3
+# Массовая доля процесса без lease: массовых отправок он не делает
+IDLE_RATE = 1
+BUDGET_INTERVAL = 10
+
+
+class TokenBucket:
+    """Классический token bucket: `rate` токенов в секунду, не больше `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def set_rate(self, rate: float):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = min(self.tokens, rate)
+
+    def is_idle(self, now: float) -> bool:
+        """Корзина полна — её можно удалить без потери состояния."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class TelegramRateLimiter:
+    """Глобальный лимит на бота плюс отдельные корзины на каждый чат."""
+
+    MAX_CHAT_BUCKETS = 10_000
+
+    def __init__(self, global_rate: float = GLOBAL_RATE):
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_idle(now)}
+            # Отрицательные chat_id — группы и каналы
+            bucket = TokenBucket(GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: int | None = None):
+        """Ждёт права на запрос. chat_id=None — запрос без сообщения в чат (ban, unban, ...)."""
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self._global.acquire()
+
+    @property
+    def global_rate(self) -> float:
+        return self._global.rate
+
+    def set_global_rate(self, rate: float):
+        self._global.set_rate(rate)
+
+    def pause(self, seconds: float):
+        """Приостанавливает все запросы (ответ 429 Too Many Requests)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def _bulk_rate(workers: int) -> float:
+    """Массовый бюджет на всех: глобальный лимит без запросов из обработчиков."""
+    return max(GLOBAL_RATE - REQUEST_RATE * max(workers, 1), IDLE_RATE)
+
+
+# Глобальный лимит общий на бота; до первого пересчёта долей (run_budget) делим поровну
+telegram_limiter = TelegramRateLimiter(_bulk_rate(config.WORKERS) / max(config.WORKERS, 1))
+request_limiter = TelegramRateLimiter(REQUEST_RATE)
+
+
+def budget_share(holders: set[str], holder: str, workers: int | None = None) -> float:
+    """Массовая доля процесса `holder` (для telegram_limiter), если lease держат процессы `holders`."""
+    workers = config.WORKERS if workers is None else workers
+    bulk = _bulk_rate(workers)
+    if not holders:
+        return bulk / max(workers, 1)
+    if holder not in holders:
+        return IDLE_RATE
+    followers = max(workers - len(holders), 0)
+    return max(bulk - IDLE_RATE * followers, IDLE_RATE) / len(holders)
+
+
+async def run_budget(limiter: TelegramRateLimiter = telegram_limiter):
+    """Раз в BUDGET_INTERVAL секунд пересчитывает долю лимита по текущим держателям lease (во всех воркерах)."""
+    while True:
+        try:
+            rate = budget_share(set(await db.get_lease_holders()), worker_id())
+            if rate != limiter.global_rate:
+                logger.info("Доля лимита Telegram: %.1f запросов/с", rate)
+                limiter.set_global_rate(rate)
+        except Exception as e:
+            logger.error(f"Ошибка пересчёта доли лимита Telegram: {e}")
+        await asyncio.sleep(BUDGET_INTERVAL)
+
+
+async def call_with_retry(chat_id: int | None, method: Callable[..., Awaitable[T]], /, *args,
+                          retries: int = 3, limiter: TelegramRateLimiter = telegram_limiter, **kwargs) -> T:
+    """Вызывает метод Bot API через лимитер, повторяя его после RetryAfter и сетевых ошибок."""
+    for attempt in range(retries + 1):
+        await limiter.acquire(chat_id)
+        try:
+            return await method(*args, **kwargs)
+        except TelegramRetryAfter as e:
+            if attempt == retries:
+                raise
+            logger.warning("Flood limit, пауза %s с", e.retry_after)
+            limiter.pause(e.retry_after)
+        except TelegramNetworkError:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+async def run_pool(items: Iterable[T], worker: Callable[[T], Awaitable[None]], concurrency: int = 10):
+    """Обрабатывает элементы очереди не более чем `concurrency` корутинами одновременно."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    async def _consume():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await worker(item)
+            except Exception as e:
+                logger.error("Ошибка обработки %r: %s", item, e)
+
+    await asyncio.gather(*(_consume() for _ in range(min(concurrency, queue.qsize()))))
@@ -0,0 +1,87 @@
+# render.py
+"""Показ экранов бота (текст + inline-клавиатура) редактированием сообщения.
+
+Screen собирается один раз — статичные экраны хранятся константами в
+хендлерах — и сразу считает отпечаток содержимого по тексту и JSON клавиатуры.
+Отпечаток последнего показанного экрана запоминается для каждого
+(chat_id, message_id). Если в сообщении уже тот же экран, запрос
+editMessageText не отправляется. Кэш живёт в памяти процесса, поэтому
+дополнительно сверяем клавиатуру из самого callback: её мог сменить другой
+воркер. Если Telegram всё же ответил «message is not modified», это тоже
+не ошибка. Новое сообщение отправляется, только когда правка невозможна:
+у сообщения нет текста (фото, документ), оно слишком старое или удалено.
+"""
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
+
+import metrics
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_SIZE = 50_000
+RENDER_CACHE_TTL = 24 * 60 * 60
+
+# (chat_id, message_id) -> отпечаток экрана, показанного в сообщении
+shown = LRUCache(RENDER_CACHE_SIZE, RENDER_CACHE_TTL)
+
+edits_skipped = metrics.Counter("bot_render_edits_skipped_total", "Правки сообщений, пропущенные без изменений")
+
+
+def _buttons(markup: InlineKeyboardMarkup | None) -> tuple:
+    # Сравнивать сами модели нельзя: у пришедших с апдейтом объектов есть привязка к Bot
+    if markup is None:
+        return ()
+    return tuple(tuple((b.text, b.callback_data, b.url) for b in row) for row in markup.inline_keyboard)
+
+
+class Screen:
+    __slots__ = ("text", "markup", "buttons", "digest")
+
+    def __init__(self, text: str, markup: InlineKeyboardMarkup | None = None):
+        self.text = text
+        self.markup = markup
+        self.buttons = _buttons(markup)
+        self.digest = hash((text, markup.model_dump_json(exclude_none=True) if markup else ""))
+
+
+def _remember(message: Message, screen: Screen):
+    shown.put((message.chat.id, message.message_id), screen.digest)
+
+
+async def edit_or_send(message: Message, screen: Screen) -> Message:
+    """Показывает screen в message (правкой) или новым сообщением; возвращает сообщение с экраном."""
+    if getattr(message, "text", None) is not None:
+        if (shown.get((message.chat.id, message.message_id)) == screen.digest
+                and _buttons(message.reply_markup) == screen.buttons):
+            edits_skipped.inc()
+            return message
+        try:
+            edited = await message.edit_text(text=screen.text, reply_markup=screen.markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message:
+                edits_skipped.inc()
+                _remember(message, screen)
+                return message
+            logger.info(f"Не удалось отредактировать сообщение {message.message_id}, отправляю новое: {e}")
+        else:
+            result = edited if isinstance(edited, Message) else message
+            _remember(result, screen)
+            return result
+
+    return await send(message, screen)
+
+
+async def send(message: Message, screen: Screen) -> Message:
+    """Отправляет screen новым сообщением в чат message и запоминает его отпечаток."""
+    sent = await message.answer(text=screen.text, reply_markup=screen.markup)
+    _remember(sent, screen)
+    return sent
+
+
+async def show(callback: CallbackQuery, screen: Screen, answer_text: str | None = None):
+    """Показывает screen в сообщении с нажатой кнопкой и гасит «часики» одним answer()."""
+    await edit_or_send(callback.message, screen)
+    await callback.answer(answer_text)
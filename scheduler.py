@@ -1,68 +1,320 @@
 import asyncio
+import heapq
 import logging
+import time
+from datetime import datetime
 
 from aiogram import Bot, Router, F
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.enums import ChatMemberStatus
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendMessage
+from aiogram.types import ChatMember, InlineKeyboardMarkup, InlineKeyboardButton
 
 import db
-from config import PRIVATE_GROUP_CHAT_ID, ADMIN_ID
+import metrics
+import outbox
+from admin_digest import admin_digest
+from callbacks import Offer, Service
+from config import PRIVATE_GROUP_CHAT_ID, ADMIN_ID, WORKERS
+from handlers.shared import months
+from leader import Lease
+from ratelimit import TelegramRateLimiter, call_with_retry, run_pool, telegram_limiter
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+# Горизонт планирования: дедлайны дальше него не держим в памяти,
+# а подгружаем из БД при следующей перезагрузке
+SCHEDULER_HORIZON = 6 * 60 * 60
+# При WORKERS > 1 колбэк on_subscription_change срабатывает только в процессе,
+# обработавшем апдейт, — вход в группу на другом воркере до ведущего не дойдёт.
+# Такой дедлайн шедулер увидит при перезагрузке, поэтому горизонт короткий
+SHARED_SCHEDULER_HORIZON = 5 * 60
+
+
+RENEW_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="💳 Продлить подписку", callback_data=Offer(service=Service.subscription).pack())]
+    ]
+)
+
+# Сколько пользователей кикаем параллельно; частоту запросов ограничивает ratelimit
+KICK_CONCURRENCY = 20
+# Сколько истёкших подписок забираем из БД за один запрос
+CLAIM_BATCH_SIZE = 500
+
+# Напоминания о продлении: за сколько дней до конца подписки и как часто проверять
+REMINDER_DAYS = 7
+REMINDER_INTERVAL = 15 * 60
+REMINDER_BATCH_SIZE = 500
+
+# Сверка users.in_group с Telegram на случай пропущенных апдейтов chat_member
+RECONCILE_INTERVAL = 6 * 60 * 60
+RECONCILE_CONCURRENCY = 20
+RECONCILE_BATCH_SIZE = 500
+
+
+async def kick_expired_user(bot: Bot, tg_id: int, username: str | None,
+                            limiter: TelegramRateLimiter = telegram_limiter) -> bool:
+    """Удаляет пользователя из закрытой группы и уведомляет его об окончании подписки.
+
+    Уведомления пользователю и админу ставятся в очередь только после успешного
+    удаления; False — удалить не удалось, пользователь остался в группе.
+    Из обработчиков апдейтов вызывается с limiter=request_limiter.
+    """
+    try:
+        await call_with_retry(None, bot.ban_chat_member, PRIVATE_GROUP_CHAT_ID, tg_id, limiter=limiter)
+        await call_with_retry(None, bot.unban_chat_member, PRIVATE_GROUP_CHAT_ID, tg_id, limiter=limiter)
+    except Exception as e:
+        metrics.scheduler_kick_failed.inc()
+        logger.error(f"Ошибка при кике пользователя {username}: {e}")
+        return False
+    metrics.scheduler_kicked.inc()
+
+    async with db.transaction():
+        await db.finish_kicks([tg_id])
+        await outbox.send_message(
+            tg_id,
+            "❌ Ваша подписка истекла!\n\n"
+            "Вы были удалены из закрытой группы. "
+            "Для продолжения доступа необходимо продлить подписку.\n\n"
+            "Нажмите кнопку ниже, чтобы выбрать тариф и оплатить:",
+            reply_markup=RENEW_KEYBOARD
+        )
+        await admin_digest.add(
+            "expired",
+            f"👋 Пользователь @{username} (ID: {tg_id}) был удалён из закрытой группы по истечении подписки.",
+            tg_id=tg_id, username=username,
+        )
+    logger.info(f"Удалён пользователь {username} (ID: {tg_id}) из закрытой группы",
+                extra={"sample": True, "tg_id": tg_id})
+    return True
+
 
 async def check_subscriptions(bot: Bot):
     """Проверяет истёкшие подписки и кикает пользователей"""
+    failed: list[int] = []
+
+    async def _kick(user):
+        if not await kick_expired_user(bot, user[0], user[1]):
+            failed.append(user[0])
+
     try:
-        expired_users = db.get_expired_subscriptions()
-        for user in expired_users:
-            tg_id = user[0]
-            username = user[1]
+        with metrics.scheduler_sweep_duration.time():
+            while expired_users := await db.claim_expired_subscriptions(CLAIM_BATCH_SIZE):
+                metrics.scheduler_expired.inc(len(expired_users))
+                await run_pool(expired_users, _kick, concurrency=KICK_CONCURRENCY)
+
+    except Exception as e:
+        logger.exception(f"Ошибка в шедулере: {e}")
+        if ADMIN_ID:
+            await bot.send_message(ADMIN_ID, f"❌ Ошибка в шедулере проверки подписок: {e}")
+    finally:
+        # Неудалённым возвращаем in_group = 1 только после прохода (иначе этот же цикл
+        # тут же забрал бы их снова) — следующий проход шедулера повторит попытку
+        await db.set_users_in_group(failed, True)
+
+
+def _reminder(tg_id: int, subscription_end: int, now: int) -> SendMessage:
+    end = datetime.fromtimestamp(subscription_end)
+    formatted_date = f"{end.day} {months[end.month - 1]} {end.year} года в {end.strftime('%H:%M')}"
+    left = "менее чем через сутки" if subscription_end - now <= 86400 else "в течение недели"
+    return SendMessage(
+        chat_id=tg_id,
+        text=(
+            f"⏳ Ваша подписка закончится {left}.\n\n"
+            f"📅 Дата окончания: {formatted_date}\n\n"
+            "Продлите подписку, чтобы не потерять доступ к закрытой группе:"
+        ),
+        reply_markup=RENEW_KEYBOARD,
+    )
+
+
+async def send_reminders() -> int:
+    """Ставит в очередь напоминания тем, чья подписка пересекла порог 7 дней или 1 дня.
+
+    Пачка выбирается одним запросом по индексу subscription_end, а флаги
+    notify_7_days / notify_1_day ставятся одним UPDATE в той же транзакции,
+    что и запись напоминаний в outbox.
+    """
+    now = int(time.time())
+    total = 0
+    while rows := await db.get_users_expiring_in(REMINDER_DAYS, now, REMINDER_BATCH_SIZE):
+        async with db.transaction():
+            await outbox.enqueue_many([_reminder(row[0], row[2], now) for row in rows])
+            await db.mark_users_notified([row[0] for row in rows], now)
+        total += len(rows)
+    if total:
+        logger.info("Поставлено в очередь напоминаний о продлении: %s", total)
+    return total
+
+
+async def run_reminders():
+    """Раз в REMINDER_INTERVAL секунд рассылает напоминания о скором окончании подписки."""
+    while True:
+        try:
+            await send_reminders()
+        except Exception as e:
+            logger.error(f"Ошибка рассылки напоминаний: {e}")
+        await asyncio.sleep(REMINDER_INTERVAL)
+
 
-            db.set_user_in_group(tg_id, False)
+def _is_member(member: ChatMember) -> bool:
+    if member.status in (ChatMemberStatus.CREATOR, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER):
+        return True
+    return member.status == ChatMemberStatus.RESTRICTED and member.is_member
 
+
+async def reconcile_membership(bot: Bot) -> tuple[int, int]:
+    """Сверяет in_group с фактическим членством в группе; возвращает (сколько вошло, сколько вышло).
+
+    Проверяются те, кто числится в группе, имеет активную подписку или не был
+    удалён из группы после её окончания (kick_pending): пачка
+    читается из БД keyset-запросом, членство запрашивается через get_chat_member
+    не более чем в RECONCILE_CONCURRENCY потоков, расхождения записываются
+    двумя UPDATE на пачку.
+    """
+    now = int(time.time())
+    after = 0
+    joined = left = 0
+    while rows := await db.get_membership_candidates(after, now, RECONCILE_BATCH_SIZE):
+        after = rows[-1][0]
+        actual: dict[int, bool] = {}
+
+        async def _check(tg_id: int):
             try:
-                await bot.ban_chat_member(PRIVATE_GROUP_CHAT_ID, tg_id)
-                await bot.unban_chat_member(PRIVATE_GROUP_CHAT_ID, tg_id)
+                member = await call_with_retry(None, bot.get_chat_member, PRIVATE_GROUP_CHAT_ID, tg_id)
+            except TelegramBadRequest as e:
+                # Telegram не знает такого участника — значит, в группе его нет;
+                # на остальные ошибки (например, нет прав в чате) флаг не меняем
+                if "user not found" in e.message or "PARTICIPANT_ID_INVALID" in e.message:
+                    actual[tg_id] = False
+                else:
+                    logger.warning(f"Не удалось проверить членство {tg_id}: {e}")
             except Exception as e:
-                print(f"Ошибка при кике пользователя {username}: {e}")
+                logger.warning(f"Не удалось проверить членство {tg_id}: {e}")
+            else:
+                actual[tg_id] = _is_member(member)
+
+        await run_pool([row[0] for row in rows], _check, concurrency=RECONCILE_CONCURRENCY)
+        now_in = [tg_id for tg_id, in_group, _ in rows if actual.get(tg_id) is True and not in_group]
+        now_out = [tg_id for tg_id, in_group, _ in rows if actual.get(tg_id) is False and in_group]
+        # Недокикнутые: в группе — вернутся в выборку шедулера через in_group, нет — удалять некого
+        gone = [tg_id for tg_id, _, kick_pending in rows if actual.get(tg_id) is False and kick_pending]
+        await db.set_users_in_group(now_in, True)
+        await db.set_users_in_group(now_out, False)
+        await db.finish_kicks(gone)
+        joined += len(now_in)
+        left += len(now_out)
+
+    if joined or left:
+        logger.info("Сверка членства в группе: вошли %s, вышли %s", joined, left)
+    return joined, left
+
+
+class ExpiryScheduler:
+    """Будильник по дедлайнам подписок.
+
+    Держит min-heap (subscription_end, tg_id) для подписок, истекающих в пределах
+    горизонта, и спит до ближайшего дедлайна. Продление подписки в
+    db.add_or_update_user переносит дедлайн; устаревшие записи кучи
+    отбрасываются лениво при извлечении.
+    """
+
+    def __init__(self, horizon: int = SCHEDULER_HORIZON):
+        self.horizon = horizon
+        self._heap: list[tuple[int, int]] = []
+        self._deadlines: dict[int, int] = {}
+        self._horizon_end = 0
+        self._sleep_until = 0
+        self._wakeup = asyncio.Event()
+
+    async def reload(self):
+        """Загружает из БД дедлайны до конца нового горизонта."""
+        self._horizon_end = int(time.time()) + self.horizon
+        rows = await db.get_subscription_deadlines(self._horizon_end)
+        self._deadlines = {row[0]: row[1] for row in rows}
+        self._heap = [(end, tg_id) for tg_id, end in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def schedule(self, tg_id: int, subscription_end: datetime):
+        """Переносит дедлайн пользователя (колбэк db.on_subscription_change)."""
+        end = int(subscription_end.timestamp())
+        if end >= self._horizon_end:
+            # Попадёт в кучу при следующей перезагрузке
+            self._deadlines.pop(tg_id, None)
+            return
+        self._deadlines[tg_id] = end
+        heapq.heappush(self._heap, (end, tg_id))
+        if end + 1 < self._sleep_until:
+            self._wakeup.set()
+
+    async def refresh(self):
+        """Перечитывает дедлайны (после сверки членства) и будит цикл run()."""
+        await self.reload()
+        self._wakeup.set()
+
+    def _next_deadline(self) -> int | None:
+        while self._heap:
+            end, tg_id = self._heap[0]
+            if self._deadlines.get(tg_id) == end:
+                return end
+            heapq.heappop(self._heap)
+        return None
 
+    def _pop_due(self, now: int) -> int:
+        due = 0
+        while (end := self._next_deadline()) is not None and end < now:
+            _, tg_id = heapq.heappop(self._heap)
+            del self._deadlines[tg_id]
+            due += 1
+        return due
+
+    async def run(self, bot: Bot):
+        await self.reload()
+        # Подписки, истёкшие пока бот был выключен
+        await check_subscriptions(bot)
+
+        while True:
+            now = int(time.time())
+            if now >= self._horizon_end:
+                await self.reload()
+                await check_subscriptions(bot)
+                continue
+
+            deadline = self._next_deadline()
+            # В БД условие строгое (subscription_end < now), поэтому +1 секунда
+            wake_at = min(deadline + 1, self._horizon_end) if deadline is not None else self._horizon_end
+            self._sleep_until = wake_at
+            self._wakeup.clear()
             try:
-                renew_keyboard = InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="💳 Продлить подписку", callback_data="buy_subscription")]
-                    ]
-                )
-
-                await bot.send_message(
-                    tg_id,
-                    "❌ Ваша подписка истекла!\n\n"
-                    "Вы были удалены из закрытой группы. "
-                    "Для продолжения доступа необходимо продлить подписку.\n\n"
-                    "Нажмите кнопку ниже, чтобы выбрать тариф и оплатить:",
-                    reply_markup=renew_keyboard
-                )
-                print(f"Уведомление отправлено пользователю {username} (ID: {tg_id})")
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(wake_at - now, 0))
+                continue  # дедлайн сдвинулся раньше — пересчитываем
+            except asyncio.TimeoutError:
+                pass
 
-            except Exception as e:
-                print(f"Не удалось уведомить пользователя {username}: {e}")
+            if self._pop_due(int(time.time())):
+                await check_subscriptions(bot)
 
-            if ADMIN_ID:
-                await bot.send_message(
-                    ADMIN_ID,
-                    f"👋 Пользователь @{username} (ID: {tg_id}) был удалён из закрытой группы по истечении подписки."
-                )
-            logger.info(f"Удаление пользователя {username} ({tg_id})")
-            print(f"Удалён пользователь {username} (ID: {tg_id}) из закрытой группы")
 
-    except Exception as e:
-        print(f"Ошибка в шедулере: {e}")
-        if ADMIN_ID:
-            await bot.send_message(ADMIN_ID, f"❌ Ошибка в шедулере проверки подписок: {e}")
+async def run_reconciler(bot: Bot, scheduler: ExpiryScheduler):
+    """Раз в RECONCILE_INTERVAL секунд сверяет членство в группе и обновляет дедлайны шедулера."""
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            await reconcile_membership(bot)
+            # Вошедшие в группу теперь участвуют в выборке дедлайнов
+            await scheduler.refresh()
+        except Exception as e:
+            logger.error(f"Ошибка сверки членства в группе: {e}")
 
 
 async def start_scheduler(bot: Bot):
-    """Запускает периодическую проверку подписок"""
-    while True:
-        await check_subscriptions(bot)
-        await asyncio.sleep(10)
+    """Запускает проверку подписок по дедлайнам (только в ведущем процессе)"""
+    scheduler = ExpiryScheduler(SCHEDULER_HORIZON if WORKERS == 1 else SHARED_SCHEDULER_HORIZON)
+    db.on_subscription_change(scheduler.schedule)
+
+    async def _job():
+        await asyncio.gather(scheduler.run(bot), run_reminders(), run_reconciler(bot, scheduler))
+
+    await Lease("scheduler").run_as_leader(_job)
@@ -0,0 +1,116 @@
+# throttling.py
+"""Антифлуд: ограничение частоты нажатий и сообщений от одного пользователя.
+
+Каждому пользователю соответствует корзина токенов (в форме GCRA: хранится
+только момент, когда корзина снова станет полной). Корзины лежат в таблице
+фиксированного размера из двух массивов, поэтому память не растёт с числом
+пользователей и не требует очистки: корзина, чей момент уже наступил, полна,
+и её слот можно отдать другому. Слот выбирается по хэшу tg_id из пары
+соседних; при нехватке места вытесняется корзина, которая полнее, — частый
+отправитель свой слот не теряет.
+
+ThrottlingMiddleware стоит на dp.update раньше остальных middleware, так что
+лишний апдейт не доходит ни до БД, ни до хендлеров. На первое отклонённое
+нажатие отвечаем коротким уведомлением, последующие до восстановления
+корзины отбрасываются молча.
+"""
+import logging
+import time
+from array import array
+from contextlib import suppress
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import TelegramObject, Update
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_TEXT = "⏳ Слишком часто. Подождите пару секунд."
+
+throttled_total = metrics.Counter("bot_throttled_total", "Апдейты, отброшенные антифлудом", ("event",))
+
+
+class UserThrottle:
+    """Таблица корзин: `rate` событий в секунду, всплеск до `burst`, `slots` слотов."""
+
+    def __init__(self, rate: float, burst: int, slots: int):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.slots = max(slots & ~1, 2)
+        self._keys = array("q", bytes(8 * self.slots))
+        # Момент, когда корзина снова полна (time.monotonic())
+        self._full_at = array("d", bytes(8 * self.slots))
+        # Пользователь уже получил уведомление о том, что его притормозили
+        self._warned = bytearray(self.slots)
+
+    def _slot(self, user_id: int) -> int:
+        i = (user_id * 2654435761) % self.slots & ~1
+        if self._keys[i] == user_id:
+            return i
+        if self._keys[i + 1] == user_id:
+            return i + 1
+        j = i if self._full_at[i] <= self._full_at[i + 1] else i + 1
+        self._keys[j] = user_id
+        self._full_at[j] = 0.0
+        self._warned[j] = 0
+        return j
+
+    def acquire(self, user_id: int, now: float) -> bool:
+        """Берёт токен; False — корзина пуста."""
+        j = self._slot(user_id)
+        full_at = max(self._full_at[j], now)
+        if full_at - now > self.tolerance:
+            return False
+        self._full_at[j] = full_at + self.interval
+        self._warned[j] = 0
+        return True
+
+    def first_rejection(self, user_id: int) -> bool:
+        """True только для первого отказа подряд — чтобы отвечать на флуд один раз."""
+        j = self._slot(user_id)
+        if self._warned[j]:
+            return False
+        self._warned[j] = 1
+        return True
+
+
+def _is_throttled_kind(update: Update) -> bool:
+    # Платёжные апдейты и служебные события (chat_member, pre_checkout_query) не режем
+    if update.callback_query is not None:
+        return True
+    return update.message is not None and update.message.successful_payment is None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: отбрасывает нажатия и сообщения сверх лимита пользователя."""
+
+    def __init__(self, rate: float = config.THROTTLE_RATE, burst: int = config.THROTTLE_BURST,
+                 slots: int = config.THROTTLE_SLOTS):
+        self.throttle = UserThrottle(rate, burst, slots)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id == config.ADMIN_ID or not _is_throttled_kind(event):
+            return await handler(event, data)
+        if self.throttle.acquire(user.id, time.monotonic()):
+            return await handler(event, data)
+
+        throttled_total.inc(event=event.event_type)
+        if event.callback_query is not None and self.throttle.first_rejection(user.id):
+            with suppress(TelegramAPIError):
+                await data["bot"].answer_callback_query(event.callback_query.id, text=THROTTLED_TEXT)
+        return None
+
+
+def setup(dp):
+    """Подключать до idempotency.setup: отброшенный апдейт не должен стоить записи в БД."""
+    dp.update.outer_middleware(ThrottlingMiddleware())
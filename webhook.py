@@ -0,0 +1,73 @@
+# webhook.py
+"""Приём обновлений через webhook (aiohttp) — альтернатива long polling для продакшена.
+
+Telegram присылает обновления POST-запросами на WEBHOOK_URL + WEBHOOK_PATH
+(обычно через reverse proxy), заголовок X-Telegram-Bot-Api-Secret-Token
+сверяется с WEBHOOK_SECRET. Каждое обновление обрабатывается отдельной задачей,
+а Telegram сразу получает ответ 200.
+"""
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def _healthz(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def build_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=config.WEBHOOK_SECRET,
+    ).register(app, path=config.WEBHOOK_PATH)
+    app.router.add_get("/healthz", _healthz)
+    app.router.add_get("/metrics", metrics.handle_metrics)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def check_config():
+    """Проверяет настройки webhook до запуска: без секрета обновления может прислать кто угодно."""
+    if not config.WEBHOOK_URL:
+        raise SystemExit("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+    if not config.WEBHOOK_SECRET:
+        raise SystemExit("Для BOT_MODE=webhook нужно задать WEBHOOK_SECRET")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, worker_index: int = 0):
+    """Регистрирует webhook в Telegram и обслуживает его до остановки процесса.
+
+    При WORKERS > 1 все процессы слушают один порт (SO_REUSEPORT),
+    а регистрирует webhook только первый из них.
+    """
+    check_config()
+
+    runner = web.AppRunner(build_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBAPP_HOST, port=config.WEBAPP_PORT, reuse_port=config.WORKERS > 1)
+    await site.start()
+
+    if worker_index == 0:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    logger.info("Webhook слушает %s:%s%s (воркер %s)",
+                config.WEBAPP_HOST, config.WEBAPP_PORT, config.WEBHOOK_PATH, worker_index)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()